@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''Keep replayed games in a SQLite database for queries across all of them.
+
+Usage: archive.py [--db DB] ingest LOG_DIR_OR_GLOB...
+       archive.py [--db DB] win-rate CARD
+
+Logs already in the database, by content, are skipped.
+'''
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+
+from batch import find_logs, load_game
+
+
+DEFAULT_DB = 'archive.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    log TEXT NOT NULL,
+    rounds INTEGER NOT NULL,
+    information TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS players (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    seat INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    score INTEGER,
+    won INTEGER NOT NULL,
+    PRIMARY KEY (game_id, seat)
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    number INTEGER NOT NULL,
+    phase_nr INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    PRIMARY KEY (game_id, phase_nr)
+);
+CREATE TABLE IF NOT EXISTS choices (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    round INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    choice TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    phase_nr INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    explored INTEGER NOT NULL,
+    cards INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    placed TEXT NOT NULL,
+    lost TEXT NOT NULL,
+    produced TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS card_events (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    card TEXT NOT NULL,
+    player TEXT NOT NULL,
+    phase_nr INTEGER NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tableaus (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    player TEXT NOT NULL,
+    card TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE INDEX IF NOT EXISTS choices_game ON choices (game_id);
+CREATE INDEX IF NOT EXISTS changes_game ON changes (game_id, player);
+CREATE INDEX IF NOT EXISTS card_events_card ON card_events (card, kind);
+CREATE INDEX IF NOT EXISTS card_events_game ON card_events (game_id, player);
+CREATE INDEX IF NOT EXISTS tableaus_card ON tableaus (card);
+CREATE INDEX IF NOT EXISTS tableaus_game ON tableaus (game_id, player);
+'''
+
+# Final scores in game information, e.g. 'Blue: 32 VP'.
+SCORE = re.compile(r'(.+?): (-?\d+) VP')
+
+
+def connect(path=DEFAULT_DB):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def log_hash(log):
+    with open(log, 'rb') as log_file:
+        return hashlib.sha1(log_file.read()).hexdigest()
+
+
+def scores(game):
+    '''Return {player name: final VP} from the game information.'''
+    names = {player.name for player in game.players}
+    result = {}
+    for message in game.information:
+        match = SCORE.match(message)
+        if match and match.group(1) in names:
+            result[match.group(1)] = int(match.group(2))
+    return result
+
+
+def store_game(connection, game, log, digest):
+    '''Insert a replayed game. Must run inside a transaction.'''
+    cursor = connection.execute(
+            'INSERT INTO games (hash, log, rounds, information) '
+            'VALUES (?, ?, ?, ?)',
+            (digest, os.path.basename(log), len(game.rounds),
+                                                '\n'.join(game.information)))
+    game_id = cursor.lastrowid
+
+    final = scores(game)
+    best = max(final.values(), default=None)
+    connection.executemany('INSERT INTO players VALUES (?, ?, ?, ?, ?)', (
+            (game_id, seat, player.name, final.get(player.name),
+                    best is not None and final.get(player.name) == best)
+            for seat, player in enumerate(game.players)))
+
+    connection.executemany('INSERT INTO rounds VALUES (?, ?, ?, ?)', (
+            (game_id, rnd.number, phase.nr, phase.name)
+            for rnd in game.rounds for phase in rnd.phases))
+    connection.executemany('INSERT INTO choices VALUES (?, ?, ?, ?)', (
+            (game_id, rnd.number, player_name, choice)
+            for rnd in game.rounds for player_name, choice in rnd.choices))
+
+    def changes():
+        for player in game.players:
+            for phase_nr in range(len(player.placed)):
+                change = player.get_changes(phase_nr)
+                yield (game_id, phase_nr, player.name, change['explored'],
+                        int(change['cards'] or 0), change['points'],
+                        change['placed'], change['lost'],
+                        ', '.join(change['produced']))
+    connection.executemany(
+            'INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            changes())
+
+    connection.executemany('INSERT INTO card_events VALUES (?, ?, ?, ?, ?)', (
+            (game_id, card, player_name, phase_nr, kind)
+            for card, events in game.index.events.items()
+            for _, player_name, phase_nr, kind in events))
+    connection.executemany('INSERT INTO tableaus VALUES (?, ?, ?)', (
+            (game_id, player.name, card)
+            for player in game.players
+            for card in player.get_tableau(len(player.placed))))
+    return game_id
+
+
+def ingest(connection, logs, cards_path='cards.txt'):
+    '''Replay and store every log not stored yet, each in a transaction of
+    its own. Returns the number of logs stored.'''
+    stored = 0
+    for log in logs:
+        digest = log_hash(log)
+        found = connection.execute('SELECT 1 FROM games WHERE hash = ?',
+                                                        (digest,)).fetchone()
+        if found:
+            print('Skipping {0}, already stored.'.format(log))
+            continue
+        game = load_game(log, cards_path)
+        with connection:
+            store_game(connection, game, log, digest)
+        stored += 1
+    return stored
+
+
+def win_rate(connection, card):
+    '''Return (games won, games played) by players who ended the game with
+    card in their tableau.'''
+    return connection.execute('''
+            SELECT COALESCE(SUM(players.won), 0), COUNT(*)
+            FROM (SELECT DISTINCT game_id, player FROM tableaus
+                    WHERE card = ?) AS owners
+            JOIN players ON players.game_id = owners.game_id
+                    AND players.name = owners.player
+            WHERE players.score IS NOT NULL
+            ''', (card,)).fetchone()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DEFAULT_DB,
+            help='database file (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest',
+            help='replay logs and store them')
+    ingest_parser.add_argument('logs', nargs='+',
+            help='directories with export_*.xml files or glob patterns')
+    ingest_parser.add_argument('--cards', default='cards.txt',
+            help='path to Keldon cards.txt (default: %(default)s)')
+    win_rate_parser = commands.add_parser('win-rate',
+            help='how often players with a card in tableau won')
+    win_rate_parser.add_argument('card')
+    args = parser.parse_args(argv)
+
+    connection = connect(args.db)
+    try:
+        if args.command == 'ingest':
+            logs = find_logs(args.logs)
+            if not logs:
+                parser.error('no logs found')
+            stored = ingest(connection, logs, args.cards)
+            print('Stored {0} of {1} logs.'.format(stored, len(logs)))
+        else:
+            won, played = win_rate(connection, args.card)
+            rate = won / played if played else 0.0
+            print('{0}: won {1} of {2} ({3:.1%})'.format(args.card, won,
+                                                            played, rate))
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
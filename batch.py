@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+'''Render reports for many Keldon exports at once.
+
+Usage: batch.py [-j WORKERS] [-o OUTPUT_DIR] LOG_DIR_OR_GLOB...
+'''
+
+import argparse
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+
+from card_index import CardIndex
+from core import Replay
+from load_data import get_data, get_card_data
+from render import produce_report, produce_index, ROUND_CACHE_DIR
+
+
+# Card data of each expansion, loaded once per worker process.
+_CARD_DATA = {}
+
+
+def find_logs(patterns):
+    '''Expand directories and glob patterns into a sorted list of logs.'''
+    logs = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, 'export_*.xml')
+        logs.update(glob(pattern))
+    return sorted(logs)
+
+
+def log_labels(logs):
+    '''Return {log: label}, where the label is the file name of the log.
+    Logs with the same file name in different directories are told apart
+    by as many parent directories as needed, e.g. a_export_1.xml and
+    b_export_1.xml.'''
+    parts = {log: os.path.abspath(log).split(os.sep) for log in logs}
+    depths = dict.fromkeys(logs, 1)
+    while True:
+        labels = {log: '_'.join(parts[log][-depth:])
+                        for log, depth in depths.items()}
+        logs_by_label = {}
+        for log, label in labels.items():
+            logs_by_label.setdefault(label, []).append(log)
+        clashing = [log for same in logs_by_label.values() if len(same) > 1
+                        for log in same if depths[log] < len(parts[log])]
+        if not clashing:
+            return labels
+        for log in clashing:
+            depths[log] += 1
+
+
+def report_name(label, compress=False):
+    name = os.path.splitext(label)[0] + '.html'
+    return name + '.gz' if compress else name
+
+
+def load_game(log, cards_path='cards.txt'):
+    '''Replay a single log into a Game.'''
+    input_data = get_data(log)
+    expansion_code = input_data['expansion_code']
+    if expansion_code not in _CARD_DATA:
+        _CARD_DATA[expansion_code] = get_card_data(expansion_code, cards_path)
+    card_data = _CARD_DATA[expansion_code]
+    return Replay(card_data).feed_all(input_data['messages'])
+
+
+def render_log(log, label, output_dir, cards_path, pretty=True,
+                        cache_dir=None, compact=False, sprite=None,
+                        compress=False):
+    '''Replay a single log and write its report, named after the label of
+    the log. Runs in a worker.'''
+    game = load_game(log, cards_path)
+    name = report_name(label, compress)
+    produce_report(game, os.path.join(output_dir, name), pretty, cache_dir,
+                                                            compact, sprite)
+    return name, game.information, game.index
+
+
+def run_batch(logs, output_dir, workers=None, cards_path='cards.txt',
+                                    pretty=True, cache_dir=None,
+                                    index_path=None, compact=False,
+                                    sprite=None, compress=False):
+    '''Render every log across a process pool, then write an index page
+    and, if index_path is given, the card index of all games. See
+    render.Renderer for compact and sprite; compress writes .html.gz files.
+    Returns the list of logs which failed.'''
+    os.makedirs(output_dir, exist_ok=True)
+    shutil.copy('style.css', output_dir)
+    if sprite:
+        shutil.copy('defs.svg', os.path.join(output_dir, sprite))
+
+    labels = log_labels(logs)
+    entries = []
+    indexes = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+                executor.submit(render_log, log, labels[log], output_dir,
+                            cards_path, pretty, cache_dir, compact, sprite,
+                            compress): log
+                for log in logs
+                }
+        for future in as_completed(futures):
+            log = futures[future]
+            try:
+                name, information, game_index = future.result()
+            except Exception as error:
+                print('Failed to process {0}: {1!r}'.format(log, error),
+                                                                file=sys.stderr)
+                failed.append(log)
+                continue
+            entries.append((name, labels[log], information))
+            indexes[labels[log]] = game_index
+
+    entries.sort(key=lambda entry: entry[1])
+    produce_index(entries, os.path.join(output_dir, 'index.html'), pretty)
+    if index_path:
+        card_index = CardIndex()
+        for _, log_name, _ in entries:
+            card_index.merge(indexes[log_name], log_name)
+        card_index.save(index_path)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('logs', nargs='+',
+            help='directories with export_*.xml files or glob patterns')
+    parser.add_argument('-o', '--output', default='reports',
+            help='directory for reports and index.html (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+            help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--cards', default='cards.txt',
+            help='path to Keldon cards.txt (default: %(default)s)')
+    parser.add_argument('--no-indent', dest='pretty', action='store_false',
+            help="don't pretty-print the HTML")
+    parser.add_argument('--cache', dest='cache_dir', action='store_const',
+            const=ROUND_CACHE_DIR, default=None,
+            help='reuse rendered rounds from earlier runs and store new ones '
+                 'in ' + ROUND_CACHE_DIR)
+    parser.add_argument('--compact', action='store_true',
+            help='draw repeated icons once with a count and skip indentation')
+    parser.add_argument('--sprite', action='store_true',
+            help='refer to icons in a shared defs.svg instead of including '
+                 'them in every report; only works when served over HTTP')
+    parser.add_argument('--gzip', action='store_true',
+            help='write reports compressed, as .html.gz')
+    parser.add_argument('--index', metavar='JSON',
+            help='also save an index of cards in all games, see card_index.py')
+    args = parser.parse_args(argv)
+
+    logs = find_logs(args.logs)
+    if not logs:
+        parser.error('no logs found')
+    failed = run_batch(logs, args.output, args.workers, args.cards,
+                        args.pretty and not args.compact, args.cache_dir,
+                        args.index, args.compact,
+                        'defs.svg' if args.sprite else None, args.gzip)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''Time card loading, log reading, replay and rendering on synthetic games.
+
+Usage: benchmarks/run.py [-o results.json] [--compare old.json]
+
+Results are written as JSON, one record per benchmark and game size, so
+runs of different versions can be compared with --compare.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import Replay
+from load_data import get_data, get_card_data
+from render import produce_report
+
+import synthetic
+
+
+SIZES = (10, 100, 1000)
+
+
+def timed(function, repeat):
+    '''Return the durations of repeat calls of function, in seconds.'''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _quiet(function):
+    '''Wrap function to run with stdout going nowhere, as get_data() and
+    produce_report() print progress.'''
+    def wrapper():
+        stdout = sys.stdout
+        with open(os.devnull, 'w') as sys.stdout:
+            try:
+                return function()
+            finally:
+                sys.stdout = stdout
+    return wrapper
+
+
+def run_size(rounds, repeat, players):
+    log = synthetic.generate('.', rounds, players)
+    input_data = _quiet(lambda: get_data(log))()
+    expansion_code = input_data['expansion_code']
+    messages = list(input_data['messages'])
+    card_data = get_card_data(expansion_code)
+
+    def open_cards():
+        get_card_data(expansion_code)
+
+    def parse_cards():
+        cards = get_card_data(expansion_code)
+        for name in cards:
+            cards[name]
+
+    def read_log():
+        for _ in get_data(log)['messages']:
+            pass
+
+    def replay():
+        Replay(card_data).feed_all(messages)
+
+    def render():
+        # Without the round cache, as every run would be a cache hit.
+        game = Replay(card_data).feed_all(messages)
+        produce_report(game, 'report.html', cache_dir=None)
+
+    benchmarks = (
+            ('get_card_data', open_cards),
+            ('get_card_data:all', parse_cards),
+            ('get_data', _quiet(read_log)),
+            ('replay', replay),
+            ('produce_report', _quiet(render)),
+            )
+    results = []
+    for name, function in benchmarks:
+        durations = timed(function, repeat)
+        results.append({
+                'name': name,
+                'rounds': rounds,
+                'players': len(players),
+                'messages': len(messages),
+                'repeat': repeat,
+                'best': min(durations),
+                'mean': sum(durations) / len(durations),
+                })
+        print('{0:22} {1:5} rounds  best {2:9.4f}s  mean {3:9.4f}s'.format(
+                name, rounds, min(durations), results[-1]['mean']))
+    return results
+
+
+def compare(results, old_path):
+    with open(old_path, 'r') as old_file:
+        old = json.load(old_file)
+    old = {(r['name'], r['rounds']): r['best'] for r in old['results']}
+    print('\nCompared with {0} (best times):'.format(old_path))
+    for result in results:
+        key = (result['name'], result['rounds'])
+        if key in old and old[key]:
+            print('{0:22} {1:5} rounds  {2:6.2f}x'.format(
+                    key[0], key[1], result['best'] / old[key]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', default='bench_results.json',
+            help='where to write results (default: %(default)s)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+            help='numbers of rounds (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='runs of each benchmark (default: %(default)s)')
+    parser.add_argument('--players', type=int, default=4,
+            help='players per game (default: %(default)s)')
+    parser.add_argument('--compare', metavar='OLD_JSON',
+            help='print ratios against an earlier results file')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    players = ('Blue', 'Red', 'Green', 'Yellow', 'Cyan', 'Magenta',
+                                                        )[:args.players]
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='ast-bench-')
+    try:
+        # render.py reads defs.svg from the working directory.
+        shutil.copy(os.path.join(ROOT, 'defs.svg'), workdir)
+        os.chdir(workdir)
+        results = []
+        for rounds in args.sizes:
+            results.extend(run_size(rounds, args.repeat, players))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    with open(output, 'w') as output_file:
+        json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results,
+                }, output_file, indent=2)
+    print('Results written to {0}'.format(output))
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+'''Synthetic Keldon AI card files and exports for benchmarks.
+
+The generated logs follow the message formats parsed by Player.update()
+and produce every kind in messages.KINDS, but the games themselves are
+random and make no sense as Race for the Galaxy. Every message starts with
+its verb, so the keywords messages.classify() falls back on are left
+untested.
+'''
+
+import os
+import random
+from xml.sax.saxutils import escape
+
+from load_data import USED_EXPANSIONS
+
+
+GOODS = ('NOVELTY', 'RARE', 'GENE', 'ALIEN')
+
+CHOICES = (
+        'Explore +5',
+        'Explore +1,+1',
+        'Develop',
+        'Settle',
+        'Consume-Trade',
+        'Consume-x2',
+        'Produce',
+        )
+
+PHASE_OF_CHOICE = {
+        'Explore +5': 'Explore',
+        'Explore +1,+1': 'Explore',
+        'Develop': 'Develop',
+        'Settle': 'Settle',
+        'Consume-Trade': 'Consume',
+        'Consume-x2': 'Consume',
+        'Produce': 'Produce',
+        }
+
+PHASES = ('Explore', 'Develop', 'Settle', 'Consume', 'Produce')
+
+# Words which render.colored() highlights, mixed into card names.
+KEYWORDS = ('Alien', 'Uplift', 'Rebel', 'Terraforming', 'Xeno', 'Imperium')
+
+
+def _card_name(rng, kind, nr):
+    return '{0} {1} {2}'.format(rng.choice(KEYWORDS), kind, nr)
+
+
+def make_cards(rng, worlds=120, developments=100, six_devs=12):
+    '''Return a list of card records:
+    (name, card_type, cost, vp, expansion, goods, flags, powers, awards)
+    '''
+    cards = [
+            ('Ancient Race', 1, 0, 0, '0', None, 'START', [], []),
+            ]
+    for nr in range(worlds):
+        goods = rng.choice(GOODS + (None,))
+        flags = []
+        if rng.random() < 0.3:
+            flags.append('MILITARY')
+        if goods and rng.random() < 0.2:
+            flags.append('WINDFALL')
+        if rng.random() < 0.1:
+            flags.append('REBEL')
+        powers = []
+        if rng.random() < 0.2:
+            powers.append('P:3:EXTRA_MILITARY:{0}:0'.format(rng.randint(1, 2)))
+        if rng.random() < 0.2:
+            powers.append('P:4:TRADE_{0}:1:0'.format(rng.choice(GOODS)))
+        cards.append((_card_name(rng, 'World', nr), 1, rng.randint(0, 6),
+                        rng.randint(0, 3), rng.choice('0123'), goods,
+                        ' | '.join(flags), powers, []))
+
+    for nr in range(developments):
+        powers = []
+        roll = rng.random()
+        if roll < 0.15:
+            powers.append('P:3:REDUCE:1:0')
+        elif roll < 0.3:
+            powers.append('P:3:REDUCE | {0}:2:0'.format(rng.choice(GOODS)))
+        elif roll < 0.45:
+            powers.append('P:3:EXTRA_MILITARY | AGAINST_REBEL:2:0')
+        elif roll < 0.6:
+            powers.append('P:3:EXTRA_MILITARY | CONSUME_{0}:2:0'.format(
+                                                            rng.choice(GOODS)))
+        elif roll < 0.7:
+            powers.append('P:3:EXTRA_MILITARY:-1:0')
+        if rng.random() < 0.3:
+            powers.append('P:1:DRAW:1:0')
+        if rng.random() < 0.1:
+            powers.append('P:1:ORB_MOVEMENT:1:0')
+        if rng.random() < 0.3:
+            powers.append('P:4:TRADE_ACTION:1:0')
+        cards.append((_card_name(rng, 'Development', nr), 2, rng.randint(1, 5),
+                        rng.randint(0, 3), rng.choice('0123'), None, '',
+                        powers, []))
+
+    named = [card[0] for card in cards[1:]]
+    award_pool = (
+            'SIX_DEVEL', 'DEVEL', 'WORLD', 'MILITARY_WORLD',
+            'NONMILITARY_WORLD', 'NOVELTY_PRODUCTION', 'GENE_WINDFALL',
+            'REBEL_FLAG', 'DEVEL_EXPLORE', 'DEVEL_TRADE', 'DEVEL_CONSUME',
+            )
+    for nr in range(six_devs):
+        awards = ['V:{0}:{1}:N/A'.format(rng.randint(1, 3), code)
+                                    for code in rng.sample(award_pool, 3)]
+        awards.append('V:2:NAME:{0}'.format(rng.choice(named)))
+        awards.append('V:1:{0}:N/A'.format(rng.choice(
+                ('THREE_VP', 'TOTAL_MILITARY', 'NEGATIVE_MILITARY'))))
+        cards.append((_card_name(rng, 'Federation', nr), 2, 6, 0,
+                        rng.choice('0123'), None, '', [], awards))
+    return cards
+
+
+def write_cards(cards, path):
+    with open(path, 'w') as card_file:
+        for name, card_type, cost, vp, expansion, goods, flags, powers, \
+                                                        awards in cards:
+            card_file.write('N:{0}\n'.format(name))
+            card_file.write('T:{0}:{1}:{2}\n'.format(card_type, cost, vp))
+            card_file.write('E@{0}:1:1\n'.format(expansion))
+            if goods:
+                card_file.write('G:{0}\n'.format(goods))
+            if flags:
+                card_file.write('F:{0}\n'.format(flags))
+            for line in powers + awards:
+                card_file.write(line + '\n')
+            card_file.write('\n')
+
+
+def make_messages(rng, cards, rounds, players):
+    '''Return a list of (message, format) pairs of a game.'''
+    names = [card[0] for card in cards if card[0] != 'Ancient Race']
+    worlds = [card[0] for card in cards if card[5]]
+    messages = []
+
+    def say(message, fmt=None):
+        messages.append((message, fmt))
+
+    say('Game started.')
+    tableaus = {}
+    for nr, player in enumerate(players):
+        homeworld = 'Ancient Race' if nr == len(players) - 1 else rng.choice(worlds)
+        tableaus[player] = [homeworld]
+        say('{0} starts with {1}.'.format(player, homeworld))
+
+    for round_nr in range(1, rounds + 1):
+        say('=== Round {0} begins ==='.format(round_nr), 'em')
+        chosen = set()
+        for player in players:
+            choice = rng.choice(CHOICES)
+            chosen.add(PHASE_OF_CHOICE[choice])
+            say('{0} chooses {1}.'.format(player, choice))
+        for phase in PHASES:
+            if phase not in chosen:
+                continue
+            say('--- {0} phase ---'.format(phase), 'phase')
+            for player in players:
+                _phase_messages(rng, say, phase, player, tableaus[player],
+                                                            names, worlds)
+            say('{0} looks around.'.format(players[0]))
+        for player in players:
+            if rng.random() < 0.3:
+                say('{0} discards {1} cards at end of round.'.format(
+                                                player, rng.randint(1, 3)))
+
+    say('=== End of game ===', 'em')
+    say('Game information')
+    for player in players:
+        say('{0}: {1} VP'.format(player, rng.randint(10, 60)))
+    return messages
+
+
+def _phase_messages(rng, say, phase, player, tableau, names, worlds):
+    if phase == 'Explore':
+        say('{0} draws {1} and keeps {2}.'.format(player, rng.randint(2, 7),
+                                                        rng.randint(1, 2)))
+        if rng.random() < 0.2:
+            # Gambling World
+            say('{0} keeps {1}.'.format(player, rng.choice(names)))
+        say('{0} receives 1 card for Explore phase.'.format(player))
+    elif phase in ('Develop', 'Settle'):
+        card = rng.choice(names)
+        if rng.random() < 0.1:
+            # Wormhole Prospectors
+            say('{0} flips {1}.'.format(player, card))
+            if rng.random() < 0.5:
+                say('{0} places {1} at zero cost.'.format(player, card))
+                tableau.append(card)
+            else:
+                say('{0} takes {1} into hand.'.format(player, card))
+        elif rng.random() < 0.1:
+            say('{0} places {1} at zero cost.'.format(player, card))
+            tableau.append(card)
+        else:
+            say('{0} places {1}.'.format(player, card))
+            tableau.append(card)
+            say('{0} pays {1} for {2}.'.format(player, rng.randint(0, 5), card))
+        if rng.random() < 0.3:
+            say('{0} receives 1 card from {1}.'.format(player, rng.choice(names)))
+        if rng.random() < 0.05 and len(tableau) > 1:
+            lost = tableau.pop(rng.randrange(1, len(tableau)))
+            say('{0} discards {1}.'.format(player, lost))
+    elif phase == 'Consume':
+        say('{0} consumes {1} cards from hand using {2}.'.format(
+                                player, rng.randint(1, 3), rng.choice(names)))
+        roll = rng.random()
+        if roll < 0.3:
+            say('{0} receives {1} VPs for Consume phase.'.format(
+                                                    player, rng.randint(1, 4)))
+        elif roll < 0.6:
+            say('{0} receives {1} cards and {2} VPs for Consume phase.'.format(
+                                player, rng.randint(1, 3), rng.randint(1, 3)))
+        else:
+            say('{0} receives {1} cards for Consume phase.'.format(
+                                                    player, rng.randint(1, 3)))
+    else:
+        world = rng.choice(worlds)
+        say('{0} produces on {1}.'.format(player, world))
+        if rng.random() < 0.3:
+            say('{0} discards 1 card to produce on {1}.'.format(player, world))
+        say('{0} receives {1} cards for Produce phase.'.format(
+                                                    player, rng.randint(1, 3)))
+        if rng.random() < 0.1:
+            say('{0} discards 1 good for extra military.'.format(player))
+
+
+def write_export(messages, path, expansion_code='3'):
+    with open(path, 'w') as log_file:
+        log_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        log_file.write('<RftgExport>\n')
+        log_file.write(' <Version>0.9.5</Version>\n')
+        log_file.write(' <Setup>\n')
+        log_file.write('  <Expansion id="{0}">Synthetic</Expansion>\n'.format(
+                                                            expansion_code))
+        log_file.write(' </Setup>\n')
+        log_file.write(' <Log>\n')
+        for message, fmt in messages:
+            fmt = ' format="{0}"'.format(fmt) if fmt else ''
+            log_file.write('  <Message{0}>{1}</Message>\n'.format(
+                                                    fmt, escape(message)))
+        log_file.write(' </Log>\n')
+        log_file.write('</RftgExport>\n')
+
+
+def generate(directory, rounds, players=('Blue', 'Red', 'Green', 'Yellow'),
+                                                expansion_code='3', seed=0):
+    '''Write cards.txt and export_synthetic_<rounds>.xml into directory and
+    return the path of the export.'''
+    rng = random.Random(seed)
+    cards = make_cards(rng)
+    # Cards outside of the expansion can't be referenced by the log.
+    used = USED_EXPANSIONS[expansion_code]
+    playable = [card for card in cards if card[4] in used]
+
+    write_cards(cards, os.path.join(directory, 'cards.txt'))
+    log = os.path.join(directory, 'export_synthetic_{0:04}.xml'.format(rounds))
+    write_export(make_messages(rng, playable, rounds, list(players)), log,
+                                                            expansion_code)
+    return log
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''Inverted index of cards: where and when each card was placed, lost or
+produced on.
+
+Usage: card_index.py INDEX CARD
+
+The index of a single game is built during the replay (see core.Game.index).
+Indexes of many games can be merged and saved, e.g. by batch.py --index.
+'''
+
+import json
+import sys
+
+
+# Kinds of events:
+PLACED = 'placed'
+LOST = 'lost'
+PRODUCED = 'produced'
+
+
+class CardIndex:
+    '''Card name -> list of (game, player name, phase number, kind).
+
+    game is None in the index of a single game and is set when the index is
+    merged into another. Games loaded from snapshots have no 'produced'
+    events, as snapshots store goods rather than worlds.'''
+
+    def __init__(self, events=None):
+        self.events = {} if events is None else events
+
+    def add(self, card, player_name, phase_nr, kind, game=None):
+        self.events.setdefault(card, []).append(
+                                        (game, player_name, phase_nr, kind))
+
+    def merge(self, other, game=None):
+        '''Add the events of another index, labelled with game unless they
+        already belong to one.'''
+        for card, events in other.events.items():
+            mine = self.events.setdefault(card, [])
+            for event_game, player_name, phase_nr, kind in events:
+                mine.append((event_game if event_game is not None else game,
+                                                player_name, phase_nr, kind))
+
+    def find(self, card, kind=None, player_name=None):
+        '''Return the events of a card, optionally only of one kind or
+        player.'''
+        return [event for event in self.events.get(card, ())
+                    if (kind is None or event[3] == kind)
+                    and (player_name is None or event[1] == player_name)]
+
+    def games(self, card):
+        '''Return the games in which card was played, in order of merging.'''
+        return list(dict.fromkeys(event[0] for event in self.find(card)))
+
+    def save(self, path):
+        with open(path, 'w') as index_file:
+            json.dump(self.events, index_file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as index_file:
+            events = json.load(index_file)
+        return cls({card: [tuple(event) for event in card_events]
+                        for card, card_events in events.items()})
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.split('\n\n')[1], file=sys.stderr)
+        return 2
+    index = CardIndex.load(argv[0])
+    for game, player_name, phase_nr, kind in index.find(argv[1]):
+        print('{0}\t{1}\t{2}\t{3}'.format(game, player_name, phase_nr, kind))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
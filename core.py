@@ -1,5 +1,12 @@
 import re
-from itertools import chain
+from array import array
+from collections import Counter
+from functools import wraps
+
+from card_index import CardIndex, PLACED, LOST, PRODUCED
+from load_data import THREE_VP, TOTAL_MILITARY, NEGATIVE_MILITARY
+from messages import classify, KINDS
+from profiling import span
 
 
 PHASES = (
@@ -18,147 +25,395 @@ VARIANTS = {
         }
 
 
+# Per-phase counters which can be summed over a range of phases, see
+# Player.total().
+COUNTERS = ('hand', 'vp', 'explored', 'produced')
+
+# Full copies of the tableau are kept every this many phases, see
+# Player.get_tableau().
+CHECKPOINT = 16
+
+# Goods are interned as they are first seen, like card flags.
+GOOD_IDS = {}
+GOOD_NAMES = []
+
+
+def good_id(good):
+    if good not in GOOD_IDS:
+        GOOD_IDS[good] = len(GOOD_NAMES)
+        GOOD_NAMES.append(good)
+    return GOOD_IDS[good]
+
+
+# Targets of military and settle bonuses, in the order they are shown.
+MILITARY_TARGETS = ('novelty', 'rare', 'gene', 'alien', 'rebel', 'xeno')
+DISCOUNT_TARGETS = ('rare', 'novelty', 'gene', 'alien')
+
+
 def get_phase_name(choice):
     return choice if choice not in VARIANTS else VARIANTS[choice]
 
 
+def phase_cached(method):
+    '''Memoize a Player method whose only argument is a phase number.
+
+    Results for phases which are still being parsed are dropped by
+    Player.invalidate_current().'''
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, phase_nr=None):
+        cached = self._cache.setdefault(phase_nr or 0, {})
+        if name in cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            cached[name] = method(self, phase_nr)
+        return cached[name]
+    return wrapper
+
+
+class Timeline:
+    '''A list of lists, one per phase, kept in two typed arrays: the values
+    of all phases and the offset where each phase starts. Values are only
+    ever added to the last phase.
+
+    encode and decode convert values to and from integers, e.g. card names
+    to their ids in the card table.'''
+
+    __slots__ = ('values', 'offsets', 'encode', 'decode')
+
+    def __init__(self, typecode, encode=None, decode=None):
+        self.values = array(typecode)
+        self.offsets = array('I', [0])
+        self.encode = encode
+        self.decode = decode
+
+    def new_phase(self):
+        self.offsets.append(len(self.values))
+
+    def append(self, value):
+        self.values.append(value if self.encode is None else self.encode(value))
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def raw(self, phase_nr):
+        '''Return the encoded values of a phase as an array.'''
+        if phase_nr < 0:
+            phase_nr += len(self.offsets)
+        if not 0 <= phase_nr < len(self.offsets):
+            raise IndexError('no phase {0}'.format(phase_nr))
+        start = self.offsets[phase_nr]
+        if phase_nr + 1 < len(self.offsets):
+            return self.values[start:self.offsets[phase_nr + 1]]
+        return self.values[start:]
+
+    def __getitem__(self, phase_nr):
+        values = self.raw(phase_nr)
+        if self.decode is None:
+            return list(values)
+        return [self.decode(value) for value in values]
+
+    def __iter__(self):
+        for phase_nr in range(len(self)):
+            yield self[phase_nr]
+
+    def __len__(self):
+        return len(self.offsets)
+
+
 class Player:
-    def __init__(self, name, homeworld, card_data):
+    def __init__(self, name, homeworld, card_data, index=None):
         self.name = name
-        # Each element of these lists represents a phase. Phase 0 is before
-        # first round.
-        self.placed = [[homeworld]]
-        self.lost = [[]]
-        self.explored = [0]
-        self.hand = [[4]]
+        # Cards are stored by their ids in the card table.
+        self._names = card_data.names
+        self._ids = card_data.ids
+        # Each element of these represents a phase. Phase 0 is before first
+        # round.
+        self.placed = Timeline('H', self._ids.__getitem__,
+                                            self._names.__getitem__)
+        self.placed.append(homeworld)
+        self.lost = Timeline('H', self._ids.__getitem__,
+                                            self._names.__getitem__)
+        self.explored = array('i', [0])
+        self.hand = Timeline('i')
+        self.hand.append(4)
         # Unlike drawing cards, VP points are gained only once per turn.
         # Therefore no need for list.
-        self.vp = [0]
-        self.produced = [[]]
+        self.vp = array('i', [0])
+        self.produced = Timeline('b', good_id, GOOD_NAMES.__getitem__)
         self.special = set()
+        # How many messages of each kind were seen, see messages.classify().
+        self.message_kinds = Counter()
+        # Kind of message -> bound _on_<kind> method, if there is one.
+        self._handlers = {kind: getattr(self, '_on_' + kind)
+                            for kind in KINDS if hasattr(self, '_on_' + kind)}
 
         self.card_data = card_data
+        # Where placed, lost and produced on cards are recorded, see
+        # card_index.CardIndex.
+        self.index = index
+
+        # The tableau is maintained as cards are placed and lost, together
+        # with running totals of military strength ({target: [min_str,
+        # potential_str]}) and settle discounts ({reduced: power}). When a
+        # phase ends, the totals are kept (shared between phases where they
+        # are equal) and every CHECKPOINT phases the card ids of the tableau,
+        # so that any earlier phase can be queried without replaying the
+        # whole game.
+        self._tableau = []
+        self._military = {}
+        self._discount = Counter()
+        self._tableau_changed = False
+        self._bonuses = []
+        self._interned_bonuses = {}
+        self._checkpoints = [array('H')]
+        self._add_bonuses(homeworld, 1)
+        self._tableau.append(homeworld)
+        self._record(homeworld, PLACED)
+
+        # Counter -> totals of the finished phases before each phase number,
+        # so that prefix[counter][nr] is the sum over phases 0 .. nr-1.
+        self._prefix = {counter: array('i', [0]) for counter in COUNTERS}
+
+        # Derived values per phase number, see phase_cached().
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def add_new_phase(self):
+        if self._tableau_changed or not self._bonuses:
+            bonuses = self._current_bonuses()
+        else:
+            bonuses = self._bonuses[-1]
+        self._bonuses.append(bonuses)
+        self._tableau_changed = False
+        for counter, prefix in self._prefix.items():
+            prefix.append(prefix[-1] + self._phase_total(counter, -1))
+
         self.explored.append(0)
-        self.placed.append([])
-        self.lost.append([])
-        self.hand.append([])
+        self.placed.new_phase()
+        self.lost.new_phase()
+        self.hand.new_phase()
         self.vp.append(0)
-        self.produced.append([])
+        self.produced.new_phase()
+        if (len(self.placed) - 1) % CHECKPOINT == 0:
+            self._checkpoints.append(
+                    array('H', map(self._ids.__getitem__, self._tableau)))
+        self.invalidate_current()
+
+    def invalidate_current(self):
+        '''Forget cached values which depend on the phase being parsed.'''
+        if not self._cache:
+            return
+        current = len(self.placed) - 1
+        for phase_nr in [nr for nr in self._cache if nr >= current]:
+            del self._cache[phase_nr]
+
+    def _current_bonuses(self):
+        '''Return (military, settle discounts) of the live tableau, in the
+        forms returned by the getters below.'''
+        military = self._military
+        normal_min, normal_potential = military.get('normal', (0, 0))
+        military_result = [('normal', normal_min,
+                                normal_min + normal_potential)]
+        for target in MILITARY_TARGETS:
+            if any(military.get(target, ())):
+                min_str, potential = military[target]
+                min_vs_target = normal_min + min_str
+                military_result.append((target, min_vs_target,
+                        min_vs_target + normal_potential + potential))
+
+        discount = self._discount
+        discount_result = [('all', discount['all'])]
+        for target in DISCOUNT_TARGETS:
+            if discount[target]:
+                discount_result.append((target,
+                                        discount[target] + discount['all']))
+        key = (tuple(military_result), tuple(discount_result))
+        return self._interned_bonuses.setdefault(key,
+                                        (military_result, discount_result))
+
+    def _bonuses_before(self, phase_nr):
+        if phase_nr <= 0:
+            return [('normal', 0, 0)], [('all', 0)]
+        if phase_nr <= len(self._bonuses):
+            return self._bonuses[phase_nr - 1]
+        # The current phase is still being parsed.
+        return self._current_bonuses()
 
     def get_tableau(self, phase_nr):
-        # It would be tempting to just add and remove to a set, but that
-        # would remove the ability to query for specific phases or ranges.
-        tableau = list(chain.from_iterable(self.placed[:phase_nr]))
-        for l in chain.from_iterable(self.lost[:phase_nr]):
-            tableau.remove(l)
-        return tableau
-
+        '''Return the tableau as it was before phase_nr, as a tuple.'''
+        if phase_nr <= 0:
+            return ()
+        if phase_nr > len(self._bonuses):
+            # The current phase is still being parsed.
+            return tuple(self._tableau)
+        # Replay the phases since the last checkpoint.
+        first = phase_nr // CHECKPOINT * CHECKPOINT
+        tableau = list(self._checkpoints[phase_nr // CHECKPOINT])
+        for nr in range(first, phase_nr):
+            tableau.extend(self.placed.raw(nr))
+            for card in self.lost.raw(nr):
+                tableau.remove(card)
+        return tuple(map(self._names.__getitem__, tableau))
+
+    def _add_bonuses(self, card, sign):
+        card = self.card_data[card]
+        for target, min_str, potential in card.military:
+            totals = self._military.setdefault(target, [0, 0])
+            totals[0] += sign * min_str
+            totals[1] += sign * potential
+        for reduced, power in card.discount:
+            self._discount[reduced] += sign * power
+
+    def _record(self, card, kind):
+        if self.index is not None:
+            self.index.add(card, self.name, len(self.placed) - 1, kind)
+
+    def _place(self, card):
+        self.placed.append(card)
+        self._tableau.append(card)
+        self._add_bonuses(card, 1)
+        self._tableau_changed = True
+        self._record(card, PLACED)
+
+    def _lose(self, card):
+        self.lost.append(card)
+        self._tableau.remove(card)
+        self._add_bonuses(card, -1)
+        self._tableau_changed = True
+        self._record(card, LOST)
+
+    def _phase_total(self, counter, phase_nr):
+        if counter == 'hand':
+            return sum(self.hand.raw(phase_nr))
+        elif counter == 'produced':
+            return len(self.produced.raw(phase_nr))
+        return getattr(self, counter)[phase_nr]
+
+    def _total_before(self, counter, phase_nr):
+        prefix = self._prefix[counter]
+        phase_nr = max(phase_nr, 0)
+        if phase_nr < len(prefix):
+            return prefix[phase_nr]
+        # The current phase is still being parsed.
+        return prefix[-1] + self._phase_total(counter, len(prefix) - 1)
+
+    def total(self, counter, start=0, stop=None):
+        '''Return the sum of a counter over phases start .. stop-1, like a
+        slice. Counters are:
+
+        hand      change of the number of cards in hand
+        vp        VP tokens gained
+        explored  cards seen while exploring
+        produced  goods produced
+        '''
+        if stop is None:
+            stop = len(self.placed)
+        return (self._total_before(counter, stop) -
+                self._total_before(counter, start))
+
+    @phase_cached
     def get_hand(self, phase_nr=None):
         phase_nr = 1 if not phase_nr else phase_nr + 1
-        return sum(chain.from_iterable(self.hand[:phase_nr]))
+        return self.total('hand', 0, phase_nr)
 
     def get_color(self):
         colors = ('red', 'green', 'yellow', 'cyan')
         color = self.name.lower() if self.name.lower() in colors else 'blue'
         return color
 
-    def get_military(self, tableau):
+    @phase_cached
+    def get_military(self, phase_nr):
         """
-        Returns a list of military strengths for each type of target
-        including 'normal'. Each element is:
+        Returns a list of military strengths of the tableau before phase_nr
+        for each type of target including 'normal'. Each element is:
 
         [target_name, min_str, max_str]
 
         where min_str is always available and max_str is total possible
         strength including temporary bonuses."""
+        return self._bonuses_before(phase_nr)[0]
 
-        targets = ('novelty', 'rare', 'gene', 'alien', 'rebel', 'xeno')
-        result = []
-        tmp = {target: [0, 0] for target in targets}
-        tmp['normal'] = [0, 0]
-
-        for card in tableau:
-            for target, bonuses in self.card_data[card]['III']['military'].items():
-                tmp[target][0] += bonuses[0]
-                tmp[target][1] += bonuses[1]
-
-        min_str = tmp['normal'][0]
-        max_str = min_str + tmp['normal'][1]
-        result.append(('normal', min_str, max_str))
-
-        tmp = {k: v for k, v in tmp.items() if any(v) or k == 'normal'}
-        for targ in targets:
-            if targ in tmp:
-                min_vs_target = tmp['normal'][0] + tmp[targ][0]
-                max_vs_target = min_vs_target + tmp['normal'][1] + tmp[targ][1]
-                result.append((targ, min_vs_target, max_vs_target))
-        return result
-
-    def get_settle_discounts(self, tableau):
-        result = []
-        targets = ('rare', 'novelty', 'gene', 'alien')
-        tmp = {reduced: 0 for reduced in targets}
-        tmp['all'] = 0
-        for card in tableau:
-            for reduced, power in self.card_data[card]['III']['discount'].items():
-                tmp[reduced] += power
-
-        result.append(('all', tmp['all']))
-
-        tmp = {k: v for k, v in tmp.items() if v or k == 'all'}
-        for targ in targets:
-            if targ in tmp:
-                result.append((targ, tmp[targ] + tmp['all']))
-        return result
-
+    @phase_cached
+    def get_settle_discounts(self, phase_nr):
+        return self._bonuses_before(phase_nr)[1]
 
     def raw_tableau_VP(self, phase_nr):
         '''Return total VP value of tableau without 6-devs'''
-        return sum(self.card_data[card]['raw_VP']
+        return sum(self.card_data[card].raw_VP
                                         for card in self.get_tableau(phase_nr))
 
-    #TODO: begs for refactoring
-    def vp_from_rewards(self, card, awards):
-        ''' How many VP does a card get from a list of awards ? (6 devs...)'''
-        for reqs, award in awards:
-            if reqs <= self.card_data[card]['flags']:
+    @phase_cached
+    def card_counts(self, phase_nr):
+        '''Return a Counter of cards in the tableau before phase_nr.'''
+        return Counter(self.get_tableau(phase_nr))
+
+    @phase_cached
+    def flag_counts(self, phase_nr):
+        '''Return a Counter of flag masks of cards in the tableau before
+        phase_nr. Cards with identical flags score identically against any
+        award which doesn't name a card.'''
+        counts = Counter()
+        for card, count in self.card_counts(phase_nr).items():
+            counts[self.card_data[card].flags] += count
+        return counts
+
+    @staticmethod
+    def vp_from_rewards(card, flags, awards):
+        ''' How many VP does a card get from a list of awards ? (6 devs...)
+
+        Only the first matching award counts. With card=None, awards naming
+        a card are skipped.'''
+        for mask, name, award in awards:
+            if mask and flags & mask == mask:
                 return award
-            elif card in reqs:
+            elif name is not None and card == name:
                 return award
         return 0
 
     # TODO: how about a new class ?
-    def question_marks(self, card, tableau):
-        '''Return the VP value for a variable VP card'''
-        award_list = self.card_data[card]['?_VP']
+    def question_marks(self, card, phase_nr):
+        '''Return the VP value for a variable VP card before phase_nr'''
+        award_list = self.card_data[card].awards
         if not award_list:
             return 0
         total = 0
-        for c in tableau:
-            total += self.vp_from_rewards(c, award_list)
-        for req, award in award_list:
-            if req == {'THREE_VP'}:
-                total += sum(self.vp)//3
-            elif req == {'TOTAL_MILITARY'}:
-                total += self.get_military(tableau)[0][1]
-            elif req == {'NEGATIVE_MILITARY'}:
-                military = self.get_military(tableau)[0][1]
+        for flags, count in self.flag_counts(phase_nr).items():
+            total += count * self.vp_from_rewards(None, flags, award_list)
+        # Named cards may match an award before the one their flags match.
+        card_counts = self.card_counts(phase_nr)
+        for name in {name for mask, name, award in award_list if name}:
+            if name in card_counts:
+                flags = self.card_data[name].flags
+                total += card_counts[name] * (
+                        self.vp_from_rewards(name, flags, award_list) -
+                        self.vp_from_rewards(None, flags, award_list))
+        for mask, name, award in award_list:
+            if mask == THREE_VP:
+                total += self.total('vp', 0, phase_nr)//3
+            elif mask == TOTAL_MILITARY:
+                total += self.get_military(phase_nr)[0][1]
+            elif mask == NEGATIVE_MILITARY:
+                military = self.get_military(phase_nr)[0][1]
                 total += abs(min(military, 0))
         return total
 
+    @phase_cached
     def tableau_question_marks(self, phase_nr):
         '''Return the total VP for all variable VP cards in tableau.'''
-        total = 0
-        tableau = self.get_tableau(phase_nr)
-        variable = [c for c in tableau if self.card_data[c]['?_VP']]
-        return sum(self.question_marks(card, tableau) for card in tableau)
+        return sum(count * self.question_marks(card, phase_nr)
+                for card, count in self.card_counts(phase_nr).items()
+                if self.card_data[card].awards)
 
+    @phase_cached
     def get_VP_bar(self, phase_nr):
         phase_nr += 1
         for_cards = self.raw_tableau_VP(phase_nr) * 'c'
-        for_tokens = sum(self.vp[:phase_nr]) * 'v'
+        for_tokens = self.total('vp', 0, phase_nr) * 'v'
         for_variable = self.tableau_question_marks(phase_nr) * '?'
         return ''.join([for_cards, for_tokens, for_variable])
 
@@ -168,7 +423,7 @@ class Player:
         expl = self.explored[phase_nr]
         lost = ', '.join(self.lost[phase_nr])
         placed = ', '.join(self.placed[phase_nr])
-        cards = sum(int(c) for c in self.hand[phase_nr] if int(c) > 0)
+        cards = sum(c for c in self.hand[phase_nr] if c > 0)
         cards = '' if not cards else str(cards)
         points = self.vp[phase_nr]
 
@@ -185,114 +440,89 @@ class Player:
                 'points': points,
                 }
         return changes
-    
+
+    def load_phase(self, placed, lost, hand, explored, vp, produced):
+        '''Fill the current phase from stored data instead of messages.'''
+        for card in placed:
+            self._place(card)
+        for card in lost:
+            self._lose(card)
+        self.hand.extend(hand)
+        self.explored[-1] = explored
+        self.vp[-1] = vp
+        self.produced.extend(produced)
+        self.invalidate_current()
+
     def draw(self, howmany):
-        self.hand[-1].append(int(howmany))
+        self.hand.append(howmany)
 
     def discard(self, howmany):
         self.draw(howmany * -1)
 
-    def _parse_placement(self, msg):
-        pattern = r'.+ places ([^.]+) at zero cost|.+ places (.+)\.'
-        match = re.search(pattern, msg)
-        placed = match.group(1) or match.group(2)
-        self.placed[-1].append(placed)
+    def _on_into_hand(self, phase_name):
+        self.draw(1)
+        self.special.remove('wormhole_prospectors')
+
+    def _on_kept(self, phase_name):
+        self.draw(1)
+
+    def _on_explored(self, phase_name, explored, kept):
+        self.explored[-1] = explored
+        self.draw(kept)
+
+    def _on_placed(self, phase_name, placed, at_zero_cost):
+        self._place(placed)
         # Wormhole Prospectors places card from top of deck - no discard
         # But Terraforming Project uses the same message and FROM HAND!!
-        if 'at zero cost' not in msg:
+        if not at_zero_cost:
             self.discard(1)
         elif 'wormhole_prospectors' not in self.special:
             self.discard(1)
         else:
             self.special.remove('wormhole_prospectors')
 
-
-    def _parse_payment(self, msg):
-        pattern = r'.+ pays (\d) (?:for|to conquer)'
-        paid = int(re.search(pattern, msg).group(1))
+    def _on_paid(self, phase_name, paid):
         self.discard(paid)
     # TODO: find a way to display BOTH number of cards gained and lost
     # over the course of a phase.
 
-    def _parse_production(self, msg):
-        planet = re.search(r'.+ produces on (.+)\.', msg).group(1)
-        produced = self.card_data[planet]['goods']
-        self.produced[-1].append(produced)
+    def _on_consumed(self, phase_name, consumed):
+        self.discard(consumed)
 
-    def _parse_card_and_point_gain(self, msg, phase_name):
-        cards = points = 0
-        if 'Explore' in msg:
-            return
+    def _on_received_from(self, phase_name, cards):
         # Sentient Robots, Scientific Cruisers are handled in
         # Produce and Consume summary lines.
-        if 'from' in msg and phase_name not in ('Settle', 'Develop'):
-            return
-        elif phase_name in ('Develop', 'Settle'):
-            # Handles on-Settle bonus including Terraforming Robots,
-            # powers that make you draw on Develop, etc.
-            cards = re.search(r'receives (\d+) cards? from', msg).group(1)
-        elif 'VP' not in msg:
-            pattern = r'receives (\d+) cards? for (Produce|Consume) phase'
-            cards = re.search(pattern, msg).group(1)
-        elif 'card' not in msg:
-            pattern = r'.+ receives (\d+) VPs? for Consume phase.'
-            points = re.search(pattern, msg).group(1)
-        elif 'card' in msg and 'VP' in msg:
-            pattern = r'.+ receives (\d+) cards? and (\d+) VPs?'
-            cards, points = re.search(pattern, msg).groups()
+        if phase_name in ('Develop', 'Settle'):
+            self._on_received(phase_name, cards, 0)
+
+    def _on_received(self, phase_name, cards, points):
         self.draw(cards)
-        self.vp[-1] = int(points)
-    #TODO: solve the int/str issue once and for all
+        self.vp[-1] = points
 
-    def _parse_card_consumption(self, msg):
-        pattern = r'.+ consumes (\d) cards? from hand using'
-        consumed = int(re.search(pattern, msg).group(1))
-        self.discard(consumed)
+    def _on_produced(self, phase_name, planet):
+        produced = self.card_data[planet].goods
+        self.produced.append(produced)
+        self._record(planet, PRODUCED)
 
-    def _parse_discard(self, msg):
-        if 'good for extra military' in msg:
-            pass
-        elif 'at end of round' in msg:
-            pattern = r'.+ discards (\d) cards? at end of round'
-            discarded = int(re.search(pattern, msg).group(1))
-            self.discard(discarded)
-        elif 'to produce on' in msg:
-            self.discard(1)
-        else:
-            # Cards discarded FROM TABLEAU (not from hand) can be
-            # distinguished by *lack* of format in the message.
-            lost = re.search(r'.+ discards ([^.]+).', msg).group(1)
-            self.lost[-1].append(lost)
-
-    def _parse_exploration(self, msg):
-        pattern = r'.+ draws (\d+) and keeps (\d+).'
-        explored, kept = re.search(pattern, msg).groups()
-        self.explored[-1] = explored
-        self.draw(kept)
+    def _on_discarded_at_end(self, phase_name, discarded):
+        self.discard(discarded)
+
+    def _on_discarded_to_produce(self, phase_name):
+        self.discard(1)
+
+    def _on_lost(self, phase_name, lost):
+        self._lose(lost)
+
+    def _on_flipped(self, phase_name):
+        self.special.add('wormhole_prospectors')
 
     def update(self, msg, fmt, phase_name):
-        if msg.endswith('into hand.'):
-            self.draw(1)
-            self.special.remove('wormhole_prospectors')
-        # Gambling World:
-        elif msg.startswith(self.name + ' keeps'):
-            self.draw(1)
-        elif 'keeps' in msg:
-            self._parse_exploration(msg)
-        elif 'places' in msg:
-            self._parse_placement(msg)
-        elif 'pays' in msg:
-            self._parse_payment(msg)
-        elif 'from hand' in msg:
-            self._parse_card_consumption(msg)
-        elif 'receives' in msg:
-            self._parse_card_and_point_gain(msg, phase_name)
-        elif 'produces on' in msg:
-            self._parse_production(msg)
-        elif 'discards' in msg and not fmt:
-            self._parse_discard(msg)
-        elif 'flips' in msg:
-            self.special.add('wormhole_prospectors')
+        kind, fields = classify(msg, fmt, self.name)
+        self.message_kinds[kind] += 1
+        handler = self._handlers.get(kind)
+        if handler is not None:
+            handler(phase_name, *fields)
+        self.invalidate_current()
 
 
 class Phase:
@@ -303,23 +533,28 @@ class Phase:
         self.nr = phase_nr
 
 
+CHOICE = re.compile(r'(.+) chooses (.+)\.')
+
+
 class Round():
     def __init__(self, number):
         self.phases = []
         self.number = number
         self.choices = []
+        # Phase name -> names of players who chose it.
+        self.choosers = {}
 
     def update_choices(self, msg):
-
-        def phase_order(choice):
-            return PHASES.index(get_phase_name(choice[1]))
-
         if ' chooses ' in msg:
-            player_name, choice = re.search(r'(.+) chooses (.+)\.', msg).groups()
+            player_name, choice = CHOICE.search(msg).groups()
             # Split to support 2 Player Advanced:
             for ch in choice.split('/'):
-                self.choices.append((player_name, ch))
-        choices = sorted(self.choices, key=phase_order)
+                self.add_choice(player_name, ch)
+
+    def add_choice(self, player_name, choice):
+        self.choices.append((player_name, choice))
+        phase_name = get_phase_name(choice)
+        self.choosers.setdefault(phase_name, []).append(player_name)
 
     def get_header(self, players):
         # This will be a list of table cells
@@ -353,11 +588,7 @@ class Round():
     # Feature envy ?
     def phase_played_by(self, phase):
         '''Return list of player names who made this phase possible.'''
-        names = []
-        for ch in self.choices:
-            if phase.name == get_phase_name(ch[1]):
-                names.append(ch[0])
-        return names
+        return self.choosers.get(phase.name, [])
 
 
 class Game:
@@ -365,6 +596,43 @@ class Game:
         self.players = []
         self.rounds = []
         self.information = []
+        # Cards placed, lost and produced on by the players.
+        self.index = CardIndex()
+        # Routes messages to players, rebuilt when players are added.
+        self._prefix = None
+        self._by_name = {}
+        self._indexed = 0
+        # Messages during phases which didn't start with a player name.
+        self.unrouted = 0
+
+    def phase_span(self, first_round, last_round=None):
+        '''Return (start, stop) phase numbers of the rounds numbered
+        first_round to last_round inclusive, for Player.total().'''
+        if last_round is None:
+            last_round = first_round
+        # Rounds are numbered from 1, in order.
+        first = max(first_round, 1) - 1
+        last = min(last_round, len(self.rounds)) - 1
+        while first <= last and not self.rounds[first].phases:
+            first += 1
+        while first <= last and not self.rounds[last].phases:
+            last -= 1
+        if first > last:
+            return 0, 0
+        return (self.rounds[first].phases[0].nr,
+                self.rounds[last].phases[-1].nr + 1)
+
+    def gained(self, player, counter, first_round, last_round=None):
+        '''Return how much of a counter (see Player.total()) a player
+        gained from first_round to last_round.'''
+        return player.total(counter, *self.phase_span(first_round,
+                                                            last_round))
+
+    def card_events(self, card, kind=None, player_name=None):
+        '''Return (player name, phase number, kind) of every time card was
+        placed, lost or produced on, optionally only of one kind or player.'''
+        events = self.index.find(card, kind, player_name)
+        return [event[1:] for event in events]
 
     def prepare_players(self):
         for player in self.players:
@@ -373,8 +641,103 @@ class Game:
     def update_player(self, msg, fmt, phase_name):
         '''Finds the player the message concerns and makes him
         update himself.'''
-        for player in self.players:
-            if msg.startswith(player.name):
-                player.update(msg, fmt, phase_name)
-                return
+        player = self.find_player(msg)
+        if player is not None:
+            player.update(msg, fmt, phase_name)
+        else:
+            self.unrouted += 1
+
+    def find_player(self, msg):
+        '''Return the first player whose name the message starts with.'''
+        if self._indexed != len(self.players):
+            self._indexed = len(self.players)
+            self._by_name = {}
+            for player in self.players:
+                self._by_name.setdefault(player.name, player)
+            # Alternatives are tried in order, like the players.
+            names = (re.escape(player.name) for player in self.players)
+            self._prefix = re.compile('|'.join(names))
+        match = self._prefix.match(msg) if self.players else None
+        if match is None:
+            return None
+        return self._by_name[match.group(0)]
+
+
+
+class Replay:
+    '''Rebuilds a Game from a stream of (message, format) pairs.
+
+    Messages are consumed one at a time, so the log is replayed in a single
+    pass and never has to be held in memory as a whole.'''
+
+    def __init__(self, card_data):
+        self.card_data = card_data
+        self.game = Game()
+        self.state = 'setup'
+        self.round = None
+        self.phase = None
+        self.round_nr = 1
+        self.phase_nr = 1
+
+    def feed(self, msg, fmt):
+        getattr(self, '_on_' + self.state)(msg, fmt)
+
+    def feed_all(self, messages):
+        with span('replay'):
+            for msg, fmt in messages:
+                self.feed(msg, fmt)
+        return self.game
+
+    def _start_round(self, msg):
+        self.round = Round(self.round_nr)
+        self.state = 'choices'
+        self.round.update_choices(msg)
+
+    def _on_setup(self, msg, fmt):
+        if 'Round' in msg:
+            self._start_round(msg)
+        elif ' starts with ' in msg:
+            name, homeworld = re.search(r'(.+) starts with (.*)\.', msg).groups()
+            player = Player(name, homeworld, self.card_data, self.game.index)
+            # Unfortunately, cards discarded at start of the game are not
+            # logged except for the human player.
+            if homeworld == 'Ancient Race':
+                player.discard(1)
+            self.game.players.append(player)
+
+    def _on_choices(self, msg, fmt):
+        # Between Round and Phase
+        if 'phase ---' in msg:
+            self.state = 'phases'
+            self._on_phases(msg, fmt)
+        else:
+            self.round.update_choices(msg)
+
+    def _on_phases(self, msg, fmt):
+        if '===' in msg:
+            self.game.rounds.append(self.round)
+            self.round_nr += 1
+            if 'End of game' in msg:
+                self.state = 'end'
+            else:
+                self._start_round(msg)
+        elif 'phase ---' in msg:
+            self.phase = Phase(msg, self.phase_nr, self.round.choices,
+                                                            self.card_data)
+            self.round.phases.append(self.phase)
+            self.phase_nr += 1
+            self.game.prepare_players()
+        else:
+            self.game.update_player(msg, fmt, self.phase.name)
+
+    def _on_end(self, msg, fmt):
+        if 'Game information' in msg:
+            self.state = 'information'
+
+    def _on_information(self, msg, fmt):
+        self.game.information.append(msg)
+        if len(self.game.information) == 3:
+            self.state = 'done'
 
+    def _on_done(self, msg, fmt):
+        pass
@@ -1,4 +1,61 @@
-import os, re
+import mmap, os, re, time
+from collections.abc import Mapping
+from functools import partial
+from itertools import chain
+from xml.parsers import expat
+
+from profiling import timed, timed_iter
+
+
+# Card flags are interned into bits of an integer as they are first seen,
+# so that testing a card against a set of flags is a single AND.
+FLAG_BITS = {}
+FLAG_NAMES = []
+
+
+def flag_mask(flags):
+    mask = 0
+    for flag in flags:
+        if flag not in FLAG_BITS:
+            FLAG_BITS[flag] = 1 << len(FLAG_NAMES)
+            FLAG_NAMES.append(flag)
+        mask |= FLAG_BITS[flag]
+    return mask
+
+
+# Awards for 6-cost developments which don't depend on the cards in tableau:
+THREE_VP = flag_mask({'THREE_VP'})
+TOTAL_MILITARY = flag_mask({'TOTAL_MILITARY'})
+NEGATIVE_MILITARY = flag_mask({'NEGATIVE_MILITARY'})
+
+
+class Card:
+    '''Compiled data of a single card.
+
+    military is a tuple of (target, min_str, potential_str) and discount
+    a tuple of (reduced, power). Each of the awards is (mask, name, vp):
+    a card scores vp if it has all the flags in mask or is called name.'''
+
+    __slots__ = (
+            'raw_VP',
+            'cost',
+            'goods',
+            'flags',
+            'military',
+            'discount',
+            'awards',
+            )
+
+    def __init__(self, parsed):
+        self.raw_VP = parsed['raw_VP']
+        self.cost = parsed['cost']
+        self.goods = parsed.get('goods')
+        self.flags = flag_mask(parsed['flags'])
+        self.military = tuple((target, bonuses[0], bonuses[1])
+                for target, bonuses in parsed['III']['military'].items())
+        self.discount = tuple(parsed['III']['discount'].items())
+        self.awards = tuple((flag_mask(reqs), name, vp)
+                                        for reqs, name, vp in parsed['?_VP'])
 
 
 def _get_fresh_card():
@@ -100,7 +157,8 @@ def _parse_conditions(line, card):
     if code in ('ALIEN_TECHNOLOGY', 'ALIEN_SCIENCE', 'ALIEN_UPLIFT'):
         return;
     elif code == 'NAME':
-        code = {name.strip()}
+        card['?_VP'].append((set(), name.strip(), int(vp)))
+        return
     elif code in ('THREE_VP', 'NEGATIVE_MILITARY', 'TOTAL_MILITARY'):
         code = {code}
     elif code.startswith('ANTI_XENO'):
@@ -108,7 +166,7 @@ def _parse_conditions(line, card):
         code = {w.lstrip('_') for w in code.partition(a) if w}
     else:
         code = set(code.split('_'))
-    card['?_VP'].append((code, int(vp)))
+    card['?_VP'].append((code, None, int(vp)))
 
 
 # Some cards (like Rebel Resistance) have identical name but differ in function.
@@ -135,54 +193,200 @@ USED_EXPANSIONS = {
         }
 
 
-def get_card_data(expansion_code):
-    card_data = {}
-    with open('cards.txt', 'r') as card_file:
-        card = None
-        for line in card_file:
-            if line.startswith('N:'):
-                card_name = line[2:].strip()
-                card = _get_fresh_card()
-            elif line.startswith('T:'):
-                _parse_card_header(line, card)
-            elif line.startswith('E@'):
-                card_expansion = line[2]
-                if card_expansion in USED_EXPANSIONS[expansion_code]:
-                    card_data[card_name] = card
-            elif line.startswith('G:'):
-                _parse_goods(line, card)
-            elif line.startswith('F:'):
-                _parse_flags(line, card)
-            elif line.startswith('P:1'):
-                _parse_explore_phase(line, card)
-            elif line.startswith('P:3'):
-                _parse_settle_phase(line, card)
-            elif line.startswith('P:4'):
-                _parse_consume_phase(line, card)
-            elif line.startswith('V:'):
-                _parse_conditions(line, card)
-    return card_data
-
-
-def get_data():
-    log = max(f for f in os.listdir('.') if f.startswith('export_'))
+def _parse_card_lines(lines):
+    '''Parse the lines of a single card record.'''
+    card = _get_fresh_card()
+    for line in lines:
+        if line.startswith('T:'):
+            _parse_card_header(line, card)
+        elif line.startswith('G:'):
+            _parse_goods(line, card)
+        elif line.startswith('F:'):
+            _parse_flags(line, card)
+        elif line.startswith('P:1'):
+            _parse_explore_phase(line, card)
+        elif line.startswith('P:3'):
+            _parse_settle_phase(line, card)
+        elif line.startswith('P:4'):
+            _parse_consume_phase(line, card)
+        elif line.startswith('V:'):
+            _parse_conditions(line, card)
+    return Card(card)
+
+
+# The start of a card record, or the expansion of the record.
+RECORD = re.compile(rb'^(?:N:([^\r\n]*)|E@(.))', re.MULTILINE)
+
+
+class CardFile(Mapping):
+    '''Card data of an expansion, read from cards.txt on demand.
+
+    Opening the file only finds where each record is and which expansions
+    it belongs to. A card is parsed when it's first looked up. Cards in
+    none of the expansions of USED_EXPANSIONS[expansion_code] are left
+    out.'''
+
+    def __init__(self, path, expansion_code):
+        self.path = path
+        self.expansion_code = expansion_code
+        with open(path, 'rb') as card_file:
+            size = os.fstat(card_file.fileno()).st_size
+            # An empty file can't be mapped.
+            self._data = mmap.mmap(card_file.fileno(), 0,
+                            access=mmap.ACCESS_READ) if size else b''
+        # Card name -> (start, end) of its record.
+        self._records = {}
+        self._cards = {}
+
+        used = {code.encode('ascii')
+                    for code in USED_EXPANSIONS[expansion_code]}
+        name = start = None
+        in_use = False
+        for match in chain(RECORD.finditer(self._data), [None]):
+            if match is None or match.group(1) is not None:
+                end = len(self._data) if match is None else match.start()
+                if name is not None and in_use:
+                    # Like in a dict, later records overwrite earlier ones.
+                    self._records[name] = start, end
+                if match is not None:
+                    name = match.group(1).decode('utf-8').strip()
+                    start, in_use = match.end(), False
+            elif match.group(2) in used:
+                # A card is used if any of its expansions is.
+                in_use = True
+        # Cards can be stored as their position in the table, see
+        # core.Timeline.
+        self.names = list(self._records)
+        self.ids = {name: nr for nr, name in enumerate(self.names)}
+
+    def __getitem__(self, name):
+        card = self._cards.get(name)
+        if card is None:
+            start, end = self._records[name]
+            # Parsers expect lines as read from a file in text mode.
+            lines = (line + '\n' for line in
+                            self._data[start:end].decode('utf-8').splitlines())
+            card = self._cards[name] = _parse_card_lines(lines)
+        return card
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    # Memory maps can't be pickled, so the file is opened again.
+    def __reduce__(self):
+        return CardFile, (self.path, self.expansion_code)
+
+
+@timed('get_card_data')
+def get_card_data(expansion_code, path='cards.txt'):
+    '''Return card data for the expansion as a read-only mapping of card
+    names to Card. Cards are parsed as they are looked up.'''
+    return CardFile(path, expansion_code)
+
+
+def _read_chunks(log, size=1 << 16):
+    with open(log, 'rb') as log_file:
+        yield from iter(partial(log_file.read, size), b'')
+
+
+def _follow_lines(log, interval):
+    '''Yield complete lines of a log which is still being written, polling
+    for new ones every interval seconds. Never returns.'''
+    position = 0
+    while True:
+        with open(log, 'rb') as log_file:
+            log_file.seek(position)
+            for line in log_file:
+                # Keldon may rewrite the export with closing tags after each
+                # save, so new messages will show up where these are now.
+                if not line.endswith(b'\n') or b'</Log>' in line:
+                    break
+                position += len(line)
+                yield line
+        time.sleep(interval)
+
+
+def _iter_events(chunks):
+    '''Parse the XML of a log fed in chunks of bytes. Yields:
+
+    ('expansion', expansion_code)
+    ('message', (message, format))
+
+    as soon as each element is complete. No tree is built, so memory use
+    doesn't grow with the log.'''
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    events = []
+    text = []
+    fmt = None
+
+    def start(tag, attributes):
+        nonlocal fmt
+        if tag == 'Message':
+            fmt = attributes.get('format')
+            text.clear()
+            parser.CharacterDataHandler = text.append
+        elif tag == 'Expansion':
+            events.append(('expansion', attributes.get('id')))
+
+    def end(tag):
+        if tag == 'Message':
+            parser.CharacterDataHandler = None
+            events.append(('message', (''.join(text), fmt)))
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        yield from events
+        events.clear()
+
+
+def _split_events(events):
+    '''Return the expansion code and an iterator over (message, format).'''
+    # The expansion is declared in the setup section, before any message.
+    expansion_code = None
+    early = []
+    for kind, value in events:
+        if kind == 'expansion':
+            expansion_code = value
+            break
+        early.append(value)
+    messages = (value for kind, value in events if kind == 'message')
+    return expansion_code, chain(early, messages)
+
+
+def get_newest_log(directory='.'):
+    log = max(f for f in os.listdir(directory) if f.startswith('export_'))
+    return os.path.join(directory, log)
+
+
+def get_data(log=None):
+    '''Open a Keldon export, by default the newest one in current dir.'''
+    if log is None:
+        log = get_newest_log()
     print('Processing {} ...'.format(log))
-    messages = []
-    with open(log, 'r') as log_file:
-        # Note to future self:
-        # (?:) is an optional non-capturing group
-        # which may contain a normal group.
-        pattern = r'.*<Message(?: format="(\w+)")?>([^<]*)<\/Message>\n'
-        for line in log_file:
-            if '<Expansion id="' in line:
-                expansion_code = line.split('"')[1]
-                continue
-            match = re.search(pattern, line)
-            if match:
-                fmt, message = match.groups()
-                messages.append((message, fmt))
+    events = _iter_events(_read_chunks(log))
+    expansion_code, messages = _split_events(events)
     return {
-            'messages': messages,
             'expansion_code': expansion_code,
+            'messages': timed_iter('get_data', messages),
             }
 
+
+def follow_data(log, interval=1.0):
+    '''Like get_data(), but messages keep coming as the log grows. The
+    iterator never ends by itself.'''
+    print('Following {} ...'.format(log))
+    events = _iter_events(_follow_lines(log, interval))
+    expansion_code, messages = _split_events(events)
+    return {
+            'expansion_code': expansion_code,
+            'messages': messages,
+            }
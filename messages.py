@@ -0,0 +1,165 @@
+'''Classification of log messages concerning a single player.
+
+Every message goes through classify() once, which returns the kind of the
+message and its fields, already converted to int where they are numbers.
+Player dispatches on the kind.'''
+
+import re
+
+
+UNKNOWN = 'unknown'
+_UNKNOWN = (UNKNOWN, ())
+
+# Kinds of events which carry fields, with the pattern extracting them.
+PATTERNS = {
+        'explored': re.compile(r' draws (\d+) and keeps (\d+).'),
+        'placed': re.compile(r' places (?:([^.]+) at zero cost|(.+)\.)'),
+        'paid': re.compile(r' pays (\d) (?:for|to conquer)'),
+        'consumed': re.compile(r' consumes (\d) cards? from hand using'),
+        'received_from': re.compile(r'receives (\d+) cards? from'),
+        # Produce and Consume summary lines.
+        'received': re.compile(
+                r'receives (?:(\d+) cards? and (\d+) VPs?'
+                r'|(\d+) VPs? for Consume phase'
+                r'|(\d+) cards? for (?:Produce|Consume) phase)'),
+        'produced': re.compile(r' produces on (.+)\.'),
+        'discarded_at_end': re.compile(
+                r' discards (\d) cards? at end of round'),
+        'lost': re.compile(r' discards ([^.]+).'),
+        }
+
+
+def _numbers(kind, msg):
+    match = PATTERNS[kind].search(msg)
+    if match is None:
+        return _UNKNOWN
+    return kind, tuple(int(group) for group in match.groups())
+
+
+def _kept(msg, fmt):
+    return 'kept', ()
+
+
+def _draws(msg, fmt):
+    return _numbers('explored', msg) if 'keeps' in msg else _UNKNOWN
+
+
+def _places(msg, fmt):
+    match = PATTERNS['placed'].search(msg)
+    if match is None:
+        return _UNKNOWN
+    placed = match.group(1) or match.group(2)
+    return 'placed', (placed, match.group(1) is not None)
+
+
+def _pays(msg, fmt):
+    return _numbers('paid', msg)
+
+
+def _consumes(msg, fmt):
+    return _numbers('consumed', msg) if 'from hand' in msg else _UNKNOWN
+
+
+def _receives(msg, fmt):
+    if 'Explore' in msg:
+        return 'received_for_explore', ()
+    # Sentient Robots, Terraforming Robots, powers that make you draw
+    # on Develop, etc.
+    if 'from' in msg:
+        return _numbers('received_from', msg)
+    match = PATTERNS['received'].search(msg)
+    if match is None:
+        return _UNKNOWN
+    both_cards, both_points, points, cards = match.groups()
+    return 'received', (int(both_cards or cards or 0),
+                        int(both_points or points or 0))
+
+
+def _produces(msg, fmt):
+    match = PATTERNS['produced'].search(msg)
+    return _UNKNOWN if match is None else ('produced', match.groups())
+
+
+def _discards(msg, fmt):
+    # Cards discarded FROM TABLEAU (not from hand) can be distinguished by
+    # *lack* of format in the message.
+    if fmt:
+        return _UNKNOWN
+    if 'good for extra military' in msg:
+        return 'discarded_good', ()
+    if 'at end of round' in msg:
+        return _numbers('discarded_at_end', msg)
+    if 'to produce on' in msg:
+        return 'discarded_to_produce', ()
+    match = PATTERNS['lost'].search(msg)
+    return _UNKNOWN if match is None else ('lost', match.groups())
+
+
+def _flips(msg, fmt):
+    return 'flipped', ()
+
+
+# Messages are tested for keywords anywhere in them, in this order, and
+# the first keyword found decides the rule. Later keywords are looser than
+# earlier ones. Cards discarded from tableau have no format, so 'discards'
+# is skipped for messages with one, see _discards().
+KEYWORDS = (
+        ('keeps', _draws),
+        ('places', _places),
+        ('pays', _pays),
+        ('from hand', _consumes),
+        ('receives', _receives),
+        ('produces on', _produces),
+        ('discards', _discards),
+        ('flips', _flips),
+        )
+
+
+def _verb(keyword):
+    '''Return the rule of a keyword and a pattern finding any keyword
+    which comes before it.'''
+    position = [kw for kw, _ in KEYWORDS].index(keyword)
+    earlier = '|'.join(re.escape(kw) for kw, _ in KEYWORDS[:position])
+    return KEYWORDS[position][1], re.compile(earlier) if earlier else None
+
+
+# Usually the verb after the player name decides right away, with the same
+# result as the keywords as long as no earlier keyword is in the message.
+VERBS = {
+        # Gambling World:
+        'keeps': (_kept, None),
+        'draws': _verb('keeps'),
+        'places': _verb('places'),
+        'pays': _verb('pays'),
+        'consumes': _verb('from hand'),
+        'receives': _verb('receives'),
+        'produces': _verb('produces on'),
+        'discards': _verb('discards'),
+        'flips': _verb('flips'),
+        }
+
+KINDS = (
+        'into_hand', 'kept', 'explored', 'placed', 'paid', 'consumed',
+        'received_for_explore', 'received_from', 'received', 'produced',
+        'discarded_good', 'discarded_at_end', 'discarded_to_produce', 'lost',
+        'flipped',
+        )
+
+
+def classify(msg, fmt, player_name):
+    '''Return (kind, fields) for a message starting with player_name.'''
+    # Whatever the verb, e.g. cards taken or drawn by a power.
+    if msg.endswith('into hand.'):
+        return 'into_hand', ()
+    words = msg[len(player_name):].split(' ', 2)
+    verb = VERBS.get(words[1]) if len(words) > 1 else None
+    if verb is not None:
+        rule, earlier = verb
+        if earlier is None or earlier.search(msg) is None:
+            event = rule(msg, fmt)
+            if event is not _UNKNOWN:
+                return event
+    for keyword, rule in KEYWORDS:
+        if keyword in msg and not (rule is _discards and fmt):
+            return rule(msg, fmt)
+    return _UNKNOWN
@@ -0,0 +1,124 @@
+'''Timing spans and counters for finding out where the time goes.
+
+Nothing is measured unless enable() was called; until then span() hands out
+a shared do-nothing context manager and timed_iter() returns the iterator
+it was given.
+'''
+
+import json
+import time
+from collections import Counter
+from contextlib import nullcontext
+from functools import wraps
+
+
+enabled = False
+
+# Span name -> [number of spans, total seconds]
+spans = {}
+counters = Counter()
+
+_NULL_SPAN = nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def reset():
+    spans.clear()
+    counters.clear()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        add_time(self.name, time.perf_counter() - self.start)
+
+
+def add_time(name, seconds):
+    span = spans.setdefault(name, [0, 0.0])
+    span[0] += 1
+    span[1] += seconds
+
+
+def span(name):
+    '''Context manager timing its block under name.'''
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    '''Decorator timing every call of a function under name.'''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterator):
+    '''Time how long it takes to get items from a lazy iterator, such as
+    messages read from a log while the game is being replayed.'''
+    if not enabled:
+        return iterator
+    return _timed_iter(name, iterator)
+
+
+def _timed_iter(name, iterator):
+    iterator = iter(iterator)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        add_time(name, total)
+
+
+def count_messages(game):
+    '''Add the kinds of messages each player of a replayed game got.'''
+    if not enabled:
+        return
+    for player in game.players:
+        for kind, count in player.message_kinds.items():
+            counters['messages:' + kind] += count
+    counters['messages:not for a player'] += game.unrouted
+
+
+def report():
+    return {
+            'spans': {
+                name: {
+                    'count': count,
+                    'total': total,
+                    'mean': total / count,
+                    }
+                for name, (count, total) in spans.items()
+                },
+            'counters': dict(counters),
+            }
+
+
+def dump(path):
+    with open(path, 'w') as output:
+        json.dump(report(), output, indent=2, sort_keys=True)
@@ -1,6 +1,11 @@
+import gzip
+import hashlib
+import os
+from itertools import groupby
+
 from yattag import Doc, indent
 
-doc, tag, text, line = Doc().ttl()
+from profiling import timed
 
 
 ROMAN = {
@@ -11,23 +16,14 @@ ROMAN = {
     'Produce': 'V'
 }
 
+CACHE_DIR = '.ast_cache'
 
-def render_cells(cells):
-    ''' Render a list of table cells. Each cell is a tuple:
-    (cell_html_class, tuple_of_contents)
-
-    if tuple_of_contents is length 1, it is inserted into
-    cell directly. Otherwise, it is rendered as an unorderd list.
-    '''
-    for cell in cells:
-        kl = cell[0]
-        if len(cell[1]) == 1:
-            line('td', cell[1][0], klass=kl)
-        else:
-            with tag('td', klass=kl):
-                with tag('ul'):
-                    for row in cell[1]:
-                        line('li', row)
+# Rendered rounds are kept here between runs, named by round_key().
+# FRAGMENT_VERSION must be bumped whenever the HTML of a round changes.
+ROUND_CACHE_DIR = os.path.join(CACHE_DIR, 'rounds')
+FRAGMENT_VERSION = 1
+# Bytes of rendered rounds to keep, see prune_cache().
+ROUND_CACHE_SIZE = 32 * 1024 * 1024
 
 
 def as_tokens(points):
@@ -47,13 +43,6 @@ def as_tokens(points):
     return [token * -1 for token in tokens]
 
 
-def render_token(value):
-    with tag('svg', klass="icon"):
-        symbol_id = 'hexagon-%s' % abs(value)
-        klass = symbol_id if value > 0 else '{0} negative'.format(symbol_id)
-        doc.stag('use', ('xlink:href', '#hexagon'), klass=klass)
-
-
 def colored(card_name):
     '''Returns the card name with certain keywords wrapped in a <span>'''
     keywords = (
@@ -76,142 +65,393 @@ def colored(card_name):
     return card_name
 
 
-def render_changes(changes):
-    if not any(changes.values()):
+def round_key(rnd, players, pretty, compact=False, sprite=None):
+    '''Hash everything the HTML of a round is rendered from.'''
+    first, last = rnd.phases[0].nr, rnd.phases[-1].nr
+    state = (
+            FRAGMENT_VERSION,
+            pretty,
+            compact,
+            sprite,
+            rnd.number,
+            rnd.choices,
+            [phase.name for phase in rnd.phases],
+            [
+                (
+                    player.name,
+                    player.get_color(),
+                    player.get_tableau(first),
+                    player.get_hand(first - 1),
+                    player.get_military(first),
+                    player.get_settle_discounts(first),
+                    [player.get_changes(phase.nr) for phase in rnd.phases],
+                    player.get_VP_bar(last),
+                )
+                for player in players
+            ],
+            )
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+
+def prune_cache(cache_dir, size=ROUND_CACHE_SIZE):
+    '''Delete the least recently used rounds in cache_dir until the rest
+    take up at most size bytes.'''
+    try:
+        with os.scandir(cache_dir) as entries:
+            fragments = [(entry.stat().st_mtime, entry.stat().st_size,
+                                entry.path) for entry in entries
+                                if entry.name.endswith('.html')]
+    except OSError:
         return
+    total = sum(fragment_size for _, fragment_size, _ in fragments)
+    for _, fragment_size, path in sorted(fragments):
+        if total <= size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Removed by another process rendering at the same time.
+            pass
+        total -= fragment_size
+
+
+class Renderer:
+    '''Writes a report to an open file.
+
+    Every round is rendered into a document of its own and written out as
+    soon as it's finished, so memory use doesn't grow with the length of
+    the game and several reports can be rendered in one process.
+
+    With cache_dir, rendered rounds are stored there under round_key() and
+    reused by later reports instead of being rendered again. Using a round
+    marks it as recently used for prune_cache().
+
+    With compact, repeated icons are drawn once with a count next to them.
+    With sprite, icons refer to symbols in that file instead of the copy of
+    defs.svg otherwise included in the report; only its patterns are
+    included. Browsers only load it over HTTP, not from local files.
+    '''
 
-    with tag('ul'):
-        if changes['explored']:
-            with tag('svg', klass="long-icon"):
-                with tag('g', transform="scale(0.75)"):
-                    doc.stag('use', ('xlink:href', '#explore'))
-                    text_id = '#number-%s' % changes['explored']
-                    doc.stag('use', ('xlink:href', text_id))
-
-                    doc.stag('use', ('xlink:href', '#card'), x=23)
-                    text_id = '#number-%s' % changes['cards']
-                    doc.stag('use', ('xlink:href', text_id), x=23)
-        if changes['lost']:
-            with tag('li'):
-                doc.asis(colored(changes['lost']))
-        if changes['placed']:
-            with tag('li'):
-                doc.asis(colored(changes['placed']))
-        if changes['points']:
-            for token in as_tokens(changes['points']):
-                render_token(token)
-        if changes['cards'] and not changes['explored']:
-            with tag('svg', klass="icon"):
-                doc.stag('use', ('xlink:href', '#card'))
-                doc.stag('use', ('xlink:href', '#number-%s' % changes['cards']),
-                        )
-
-    # Putting a couple of icons inside a single <svg> tag is more trouble than
-    # it's worth. Probably the cleanest way is --icon-width CSS variable
-    # and using translate on subsequent icons.
-    if changes['produced']:
-        for good in changes['produced']:
-            with tag('svg', klass="icon"):
-                doc.stag('use', ('xlink:href', '#good'), klass=good)
-
-
-#BUG: displays info from the start of the used phase, not end of round
-def render_bar_graph(players, phase_nr):
-    with tag('ul', klass='bar-graph'):
-        for player in reversed(sorted(players, key=lambda x: len(x.get_VP_bar(phase_nr)))):
-            with tag('li'):
-                total = ' {0}'.format(str(len(player.get_VP_bar(phase_nr))))
-                line('span', player.get_VP_bar(phase_nr), klass=player.get_color())
-                text(total)
-
-
-
-def render_military_circle(content, klass):
-    with tag('svg', klass="icon"):
-        doc.stag('use', ('xlink:href', '#military'), klass=klass)
-
-        plus = '+' if int(content) >= 0 else ''
-        with tag('text', ('text-anchor', 'middle'), x="9", y="17", fill="red"):
-            text(plus + content)
-
-
-def render_military(player, phase_nr):
-    for l in player.get_military(player.get_tableau(phase_nr)):
-        target, min_str, max_str = l
-        if target != 'normal':
-            text('/')
-        min_str = str(min_str)
-        max_str = str(max_str)
-
-        render_military_circle(min_str, target)
-        if max_str > min_str:
-            text('-')
-            render_military_circle(max_str, target)
-
-
-def render_settle_discounts(player, phase_nr):
-    for l in player.get_settle_discounts(player.get_tableau(phase_nr)):
-        reduced, power = l
-        if not power:
-            continue
-        with tag('svg', klass="icon"):
-            doc.stag('use', ('xlink:href', '#settle-discount'), klass=reduced)
-            with tag('text', ('text-anchor', 'middle'), x="9", y="17", fill="black"):
-                text('-{0}'.format(power))
-
-
-def render_settle_bonuses(player, phase_number):
-    with tag('ul'):
-        with tag('li'):
-            render_military(player, phase_number)
-        with tag('li'):
-            render_settle_discounts(player, phase_number)
-
-
-
-def produce_report(game):
+    def __init__(self, output, pretty=True, cache_dir=None, compact=False,
+                                                                sprite=None):
+        self.output = output
+        self.pretty = pretty
+        self.cache_dir = cache_dir
+        self.compact = compact
+        self.sprite = sprite
+        self.rounds_rendered = 0
+        self.rounds_cached = 0
+        self.rounds_stored = 0
+        self._new_doc()
+
+    def _new_doc(self):
+        self.doc, self.tag, self.text, self.line = Doc().ttl()
+
+    def _take(self):
+        '''Return everything rendered so far and start a new document.'''
+        value = self.doc.getvalue()
+        if self.pretty:
+            value = indent(value)
+        self._new_doc()
+        return value + '\n' if value else ''
+
+    def flush(self):
+        '''Write out everything rendered so far and start a new document.'''
+        self.output.write(self._take())
+
+    def begin(self, information=None):
+        # yattag only writes a tag once it's closed, so the tags which
+        # enclose the rounds are written by hand.
+        print('<html>', file=self.output)
+        with self.tag('meta'):
+            self.doc.stag('link', rel="stylesheet", href="style.css")
+        self.flush()
+        print('<body>', file=self.output)
+        with open('defs.svg', 'r') as defs:
+            svg = '\n'.join(defs.readlines())
+        if self.sprite is not None:
+            # The VP patterns are filled in by style.css, which can only
+            # refer to ones in the report, so only the symbols are left out.
+            svg = svg[:svg.index('</defs>') + len('</defs>')] + '\n</svg>'
+        self.doc.asis(svg)
+        if information is not None:
+            self.render_information(information)
+        self.flush()
+
+    def end(self):
+        print('</body>', file=self.output)
+        print('</html>', file=self.output)
+
+    def render_information(self, information):
+        with self.tag('ul'):
+            for message in information:
+                self.line('li', message)
+
+    def render_cells(self, cells):
+        ''' Render a list of table cells. Each cell is a tuple:
+        (cell_html_class, tuple_of_contents)
+
+        if tuple_of_contents is length 1, it is inserted into
+        cell directly. Otherwise, it is rendered as an unorderd list.
+        '''
+        tag, line = self.tag, self.line
+        for cell in cells:
+            kl = cell[0]
+            if len(cell[1]) == 1:
+                line('td', cell[1][0], klass=kl)
+            else:
+                with tag('td', klass=kl):
+                    with tag('ul'):
+                        for row in cell[1]:
+                            line('li', row)
+
+    def href(self, symbol):
+        '''Return the reference to a symbol of defs.svg.'''
+        return '{0}#{1}'.format(self.sprite or '', symbol)
+
+    def render_count(self, count):
+        if count > 1:
+            with self.tag('span', klass='count'):
+                self.doc.asis('&times;{0}'.format(count))
+
+    def render_tokens(self, tokens):
+        '''Render VP tokens, see as_tokens().'''
+        if not self.compact:
+            for token in tokens:
+                self.render_token(token)
+            return
+        for token, same in groupby(tokens):
+            self.render_token(token)
+            self.render_count(len(list(same)))
+
+    def render_token(self, value):
+        with self.tag('svg', klass="icon"):
+            symbol_id = 'hexagon-%s' % abs(value)
+            klass = symbol_id if value > 0 else '{0} negative'.format(symbol_id)
+            self.doc.stag('use', ('xlink:href', self.href('hexagon')),
+                                                                klass=klass)
+
+    def render_goods(self, goods):
+        # Putting a couple of icons inside a single <svg> tag is more trouble
+        # than it's worth. Probably the cleanest way is --icon-width CSS
+        # variable and using translate on subsequent icons.
+        counted = groupby(goods) if self.compact else ((good, (good,))
+                                                            for good in goods)
+        for good, same in counted:
+            with self.tag('svg', klass="icon"):
+                self.doc.stag('use', ('xlink:href', self.href('good')),
+                                                                klass=good)
+            if self.compact:
+                self.render_count(len(list(same)))
+
+    def render_changes(self, changes):
+        if not any(changes.values()):
+            return
+
+        doc, tag = self.doc, self.tag
+        with tag('ul'):
+            if changes['explored']:
+                with tag('svg', klass="long-icon"):
+                    with tag('g', transform="scale(0.75)"):
+                        doc.stag('use', ('xlink:href', self.href('explore')))
+                        text_id = self.href('number-%s' % changes['explored'])
+                        doc.stag('use', ('xlink:href', text_id))
+
+                        doc.stag('use', ('xlink:href', self.href('card')),
+                                                                        x=23)
+                        text_id = self.href('number-%s' % changes['cards'])
+                        doc.stag('use', ('xlink:href', text_id), x=23)
+            if changes['lost']:
+                with tag('li'):
+                    doc.asis(colored(changes['lost']))
+            if changes['placed']:
+                with tag('li'):
+                    doc.asis(colored(changes['placed']))
+            if changes['points']:
+                self.render_tokens(as_tokens(changes['points']))
+            if changes['cards'] and not changes['explored']:
+                with tag('svg', klass="icon"):
+                    doc.stag('use', ('xlink:href', self.href('card')))
+                    doc.stag('use', ('xlink:href',
+                                self.href('number-%s' % changes['cards'])),
+                            )
+
+        if changes['produced']:
+            self.render_goods(changes['produced'])
+
+    #BUG: displays info from the start of the used phase, not end of round
+    def render_bar_graph(self, players, phase_nr):
+        with self.tag('ul', klass='bar-graph'):
+            for player in reversed(sorted(players, key=lambda x: len(x.get_VP_bar(phase_nr)))):
+                with self.tag('li'):
+                    total = ' {0}'.format(str(len(player.get_VP_bar(phase_nr))))
+                    self.line('span', player.get_VP_bar(phase_nr), klass=player.get_color())
+                    self.text(total)
+
+    def render_military_circle(self, content, klass):
+        with self.tag('svg', klass="icon"):
+            self.doc.stag('use', ('xlink:href', self.href('military')),
+                                                                klass=klass)
+
+            plus = '+' if int(content) >= 0 else ''
+            with self.tag('text', ('text-anchor', 'middle'), x="9", y="17", fill="red"):
+                self.text(plus + content)
+
+    def render_military(self, player, phase_nr):
+        for l in player.get_military(phase_nr):
+            target, min_str, max_str = l
+            if target != 'normal':
+                self.text('/')
+            min_str = str(min_str)
+            max_str = str(max_str)
+
+            self.render_military_circle(min_str, target)
+            if max_str > min_str:
+                self.text('-')
+                self.render_military_circle(max_str, target)
+
+    def render_settle_discounts(self, player, phase_nr):
+        for l in player.get_settle_discounts(phase_nr):
+            reduced, power = l
+            if not power:
+                continue
+            with self.tag('svg', klass="icon"):
+                self.doc.stag('use', ('xlink:href',
+                                self.href('settle-discount')), klass=reduced)
+                with self.tag('text', ('text-anchor', 'middle'), x="9", y="17", fill="black"):
+                    self.text('-{0}'.format(power))
+
+    def render_settle_bonuses(self, player, phase_number):
+        with self.tag('ul'):
+            with self.tag('li'):
+                self.render_military(player, phase_number)
+            with self.tag('li'):
+                self.render_settle_discounts(player, phase_number)
+
+    @timed('render_round')
+    def render_round(self, rnd, players):
+        '''Render the table of a finished round and write it out.'''
+        self.flush()
+        self.rounds_rendered += 1
+        if self.cache_dir is None:
+            self._render_round(rnd, players)
+            self.flush()
+            return
+
+        path = os.path.join(self.cache_dir,
+                round_key(rnd, players, self.pretty, self.compact, self.sprite)
+                + '.html')
+        try:
+            with open(path, 'r') as fragment:
+                value = fragment.read()
+        except OSError:
+            value = None
+        if value is not None:
+            self.output.write(value)
+            self.rounds_cached += 1
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return
+
+        self._render_round(rnd, players)
+        value = self._take()
+        self.output.write(value)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = '{0}.{1}'.format(path, os.getpid())
+            with open(tmp_path, 'w') as fragment:
+                fragment.write(value)
+            os.replace(tmp_path, path)
+            self.rounds_stored += 1
+        except OSError:
+            pass
+
+    def _render_round(self, rnd, players):
+        tag, line = self.tag, self.line
+        title_id = 'title-{0}'.format(rnd.number)
+        line('h2', 'Round %s' % rnd.number, target=title_id)
+        parent_id = 'table-{0}'.format(rnd.number)
+        with tag('table', id=parent_id):
+            with tag('tr'):
+                with tag('td'):
+                    line('a', 'Show bonuses', href='#' + parent_id)
+                    line('a', 'Hide bonuses', klass='hidden', href='#' + title_id)
+                self.render_cells(rnd.get_header(players))
+            with tag('tr', klass='hidden'):
+                line('td', 'phase bonuses')
+                for pl in players:
+                    with tag('td'):
+                        self.render_settle_bonuses(pl, rnd.phases[0].nr)
+            for phase in rnd.phases:
+                with tag('tr'):
+                    line('td', ROMAN[phase.name])
+                    for player in players:
+                        klass = ''
+                        if player.name in rnd.phase_played_by(phase):
+                            klass = player.get_color()
+                        with tag('td', klass=klass):
+                            self.render_changes(player.get_changes(phase.nr))
+        self.render_bar_graph(players, phase.nr)
+        vp_taken = 0
+        for player in players:
+            vp_taken += len(player.get_VP_bar(phase.nr).strip('c?'))
+        vp_left = as_tokens(12 * len(players) - vp_taken)
+        self.render_tokens(vp_left)
+
+
+@timed('produce_report')
+def produce_report(game, path='report.html', pretty=True,
+            cache_dir=ROUND_CACHE_DIR, compact=False, sprite=None):
+    '''Write the report of a game, compressed with gzip if path ends
+    with .gz. See Renderer for the options.'''
+    print("Generating '{0}' ...".format(path))
+    if path.endswith('.gz'):
+        output = gzip.open(path, 'wt', encoding='utf-8')
+    else:
+        output = open(path, 'w')
+    with output:
+        write_report(game, output, pretty, cache_dir, compact, sprite)
+
+
+def write_report(game, output, pretty=True, cache_dir=ROUND_CACHE_DIR,
+                                                compact=False, sprite=None):
+    '''Render the report of a game into an open file.'''
+    renderer = Renderer(output, pretty, cache_dir, compact, sprite)
+    renderer.begin(game.information)
+    for rnd in game.rounds:
+        renderer.render_round(rnd, game.players)
+    renderer.end()
+    if renderer.rounds_stored:
+        prune_cache(cache_dir)
+
+
+def produce_index(entries, path, pretty=True):
+    '''Write a page linking to reports, see render_index().'''
+    with open(path, 'w') as output:
+        print(render_index(entries, pretty), file=output)
+
+
+def render_index(entries, pretty=True):
+    '''Render a page linking to reports. Each entry is a tuple:
+    (report_href, log_name, information_lines)
+    '''
+    doc, tag, text, line = Doc().ttl()
     with tag('html'):
         with tag('meta'):
             doc.stag('link', rel="stylesheet", href="style.css")
         with tag('body'):
-            doc.asis('\n'.join(open('defs.svg', 'r').readlines()))
-            with tag('ul'):
-                for message in game.information:
-                    line('li', message)
-            for rnd in game.rounds:
-                title_id = 'title-{0}'.format(rnd.number)
-                line('h2', 'Round %s' % rnd.number, target=title_id)
-                parent_id = 'table-{0}'.format(rnd.number)
-                with tag('table', id=parent_id):
+            line('h1', 'Games')
+            with tag('table'):
+                for href, log_name, information in entries:
                     with tag('tr'):
                         with tag('td'):
-                            line('a', 'Show bonuses', href='#' + parent_id)
-                            line('a', 'Hide bonuses', klass='hidden', href='#' + title_id)
-                        render_cells(rnd.get_header(game.players))
-                    with tag('tr', klass='hidden'):
-                        line('td', 'phase bonuses')
-                        for pl in game.players:
-                            with tag('td'):
-                                render_settle_bonuses(pl, rnd.phases[0].nr)
-                    for phase in rnd.phases:
-                        with tag('tr'):
-                            line('td', ROMAN[phase.name])
-                            for player in game.players:
-                                klass = ''
-                                if player.name in rnd.phase_played_by(phase):
-                                    klass = player.get_color()
-                                with tag('td', klass=klass):
-                                    render_changes(player.get_changes(phase.nr))
-                render_bar_graph(game.players, phase.nr)
-                vp_taken = 0
-                for player in game.players:
-                    vp_taken += len(player.get_VP_bar(phase.nr).strip('c?'))
-                vp_left = as_tokens(12 * len(game.players) - vp_taken)
-                for token in vp_left:
-                    render_token(token)
-
-
-    output = open('report.html', 'w')
-    print("Generating 'report.html' ...")
-    print(indent(doc.getvalue()), file=output)
+                            line('a', log_name, href=href)
+                        with tag('td'):
+                            with tag('ul'):
+                                for message in information:
+                                    line('li', message)
 
+    value = doc.getvalue()
+    return indent(value) if pretty else value
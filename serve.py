@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+'''Serve reports of the logs in a directory over HTTP on localhost.
+
+Usage: serve.py [-d LOG_DIR] [-p PORT] [-j WORKERS]
+
+Reports are rendered when first requested. Replayed games are kept by the
+workers and rendered pages by the server, both in bounded LRU caches, and
+rendered again only when the log changes.
+'''
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+from batch import find_logs, log_labels, load_game, report_name
+from render import write_report, render_index, ROUND_CACHE_DIR
+
+
+HOST = '127.0.0.1'
+
+REASONS = {
+        200: 'OK',
+        400: 'Bad Request',
+        404: 'Not Found',
+        405: 'Method Not Allowed',
+        500: 'Internal Server Error',
+        }
+
+
+class LRUCache:
+    '''A mapping which forgets the least recently used items once it holds
+    more than size of them.'''
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Replayed games of a worker process, by log_key().
+_GAMES = LRUCache(8)
+
+
+def _init_worker(games):
+    _GAMES.size = games
+
+
+def log_key(log):
+    '''Identify a version of a log, so that changed logs are replayed.'''
+    stat = os.stat(log)
+    return log, stat.st_size, stat.st_mtime_ns
+
+
+def render_page(key, cards_path, pretty, cache_dir):
+    '''Return the report of a log and its game information. Runs in a
+    worker.'''
+    game = _GAMES.get(key)
+    if game is None:
+        game = load_game(key[0], cards_path)
+        _GAMES.put(key, game)
+    output = io.StringIO()
+    write_report(game, output, pretty, cache_dir)
+    return output.getvalue(), game.information
+
+
+class ReportServer:
+    def __init__(self, directory, executor, cards_path='cards.txt',
+                        pretty=True, cache_dir=None, pages=32):
+        self.directory = directory
+        self.executor = executor
+        self.cards_path = cards_path
+        self.pretty = pretty
+        self.cache_dir = cache_dir
+        self.pages = LRUCache(pages)
+        # Game information of every log rendered so far, for the index.
+        self.information = {}
+        # Renders in progress, shared by requests for the same log.
+        self._pending = {}
+
+    def logs(self):
+        '''Return {report name: (log, label)} of the logs in the
+        directory.'''
+        labels = log_labels(find_logs([self.directory]))
+        return {report_name(label): (log, label)
+                        for log, label in labels.items()}
+
+    async def page(self, log):
+        key = log_key(log)
+        cached = self.pages.get(key)
+        if cached is not None:
+            return cached
+        if key not in self._pending:
+            loop = asyncio.get_running_loop()
+            self._pending[key] = loop.run_in_executor(self.executor,
+                    render_page, key, self.cards_path, self.pretty,
+                    self.cache_dir)
+        try:
+            html, information = await self._pending[key]
+        finally:
+            self._pending.pop(key, None)
+        self.pages.put(key, html)
+        self.information[log] = information
+        return html
+
+    def index(self):
+        entries = [(name, label, self.information.get(log, []))
+                        for name, (log, label) in sorted(self.logs().items())]
+        return render_index(entries, self.pretty)
+
+    async def respond(self, path):
+        '''Return (status, content type, body) for a requested path.'''
+        name = unquote(path.split('?')[0]).lstrip('/')
+        if name in ('', 'index.html'):
+            return 200, 'text/html', self.index()
+        if name == 'style.css':
+            with open('style.css', 'r') as style:
+                return 200, 'text/css', style.read()
+        log, _ = self.logs().get(name, (None, None))
+        if log is None:
+            return 404, 'text/plain', 'No such report.\n'
+        return 200, 'text/html', await self.page(log)
+
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            # Headers aren't used.
+            while (await reader.readline()).strip():
+                pass
+            if len(request) != 3:
+                status, content_type, body = 400, 'text/plain', 'Bad request.\n'
+            elif request[0] != 'GET':
+                status, content_type, body = (405, 'text/plain',
+                                                'Only GET is supported.\n')
+            else:
+                try:
+                    status, content_type, body = await self.respond(request[1])
+                except Exception as error:
+                    print('Failed to serve {0}: {1!r}'.format(request[1],
+                                                    error), file=sys.stderr)
+                    status, content_type, body = (500, 'text/plain',
+                                                            'Failed.\n')
+            body = body.encode('utf-8')
+            writer.write('HTTP/1.0 {0} {1}\r\n'
+                         'Content-Type: {2}; charset=utf-8\r\n'
+                         'Content-Length: {3}\r\n'
+                         'Connection: close\r\n\r\n'.format(status,
+                            REASONS[status], content_type, len(body))
+                         .encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server, port):
+    listener = await asyncio.start_server(server.handle, HOST, port)
+    print('Serving reports of {0} on http://{1}:{2}/'.format(
+                                        server.directory, HOST, port))
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-d', '--directory', default='.',
+            help='directory with export_*.xml files (default: %(default)s)')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+            help='port on localhost (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+            help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--cards', default='cards.txt',
+            help='path to Keldon cards.txt (default: %(default)s)')
+    parser.add_argument('--pages', type=int, default=32,
+            help='rendered pages to keep (default: %(default)s)')
+    parser.add_argument('--games', type=int, default=8,
+            help='replayed games each worker keeps (default: %(default)s)')
+    parser.add_argument('--no-indent', dest='pretty', action='store_false',
+            help="don't pretty-print the HTML")
+    parser.add_argument('--cache', dest='cache_dir', action='store_const',
+            const=ROUND_CACHE_DIR, default=None,
+            help='reuse rendered rounds from earlier runs and store new ones '
+                 'in ' + ROUND_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    with ProcessPoolExecutor(max_workers=args.workers,
+                    initializer=_init_worker, initargs=(args.games,)) \
+                                                            as executor:
+        server = ReportServer(args.directory, executor, args.cards,
+                                args.pretty, args.cache_dir, args.pages)
+        try:
+            asyncio.run(serve(server, args.port))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''Compact binary snapshots of replayed games.
+
+A snapshot lets a report be rendered again, or a game analysed, without
+reading the XML log and running every message through the parser.
+
+Usage: snapshot.py save LOG SNAPSHOT
+       snapshot.py report SNAPSHOT [REPORT]
+
+Layout:
+
+    magic     4 bytes   b'ASTS'
+    version   uint16    VERSION, little endian
+    length    uint32    length of the header, little endian
+    header    JSON      see write()
+    columns   typed arrays, each aligned to 8 bytes
+
+Columns use the byte order recorded in the header. Card names and goods in
+the columns are indices into the header's string table. Per-phase lists
+are stored as two columns: all values of all phases, and the offsets where
+each phase starts (CSR).
+'''
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from core import Game, Player, Round, Phase, Replay
+from load_data import get_data, get_card_data
+from render import produce_report
+
+
+MAGIC = b'ASTS'
+VERSION = 1
+PREAMBLE = struct.Struct('<4sHI')
+ALIGNMENT = 8
+
+# Per-phase columns holding a single number.
+SCALARS = ('explored', 'vp')
+# Per-phase columns holding lists; placed, lost and produced are strings.
+LISTS = ('placed', 'lost', 'hand', 'produced')
+STRINGS = ('placed', 'lost', 'produced')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _columns(player, strings):
+    '''Encode the timeline of a player into typed arrays.'''
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    columns = {}
+    for name in SCALARS:
+        columns[name] = array('i', getattr(player, name))
+    for name in LISTS:
+        offsets = array('i', [0])
+        values = array('i')
+        for phase in getattr(player, name):
+            if name in STRINGS:
+                values.extend(intern(value) for value in phase)
+            else:
+                values.extend(phase)
+            offsets.append(len(values))
+        columns[name + '.offsets'] = offsets
+        columns[name + '.values'] = values
+    return columns
+
+
+def write(game, path, expansion_code):
+    '''Write a replayed game to path.
+
+    The header holds the expansion, game information, rounds with their
+    choices and phases, player names, the string table and for every
+    column its type code, byte offset and length.'''
+    strings = {}
+    columns = {}
+    for nr, player in enumerate(game.players):
+        for name, column in _columns(player, strings).items():
+            columns['{0}.{1}'.format(nr, name)] = column
+
+    directory = {}
+    position = 0
+    for name, column in columns.items():
+        directory[name] = [column.typecode, position, len(column)]
+        size = len(column) * column.itemsize
+        position += size + -size % ALIGNMENT
+
+    header = {
+            'expansion_code': expansion_code,
+            'information': game.information,
+            'players': [player.name for player in game.players],
+            'rounds': [
+                {
+                    'number': rnd.number,
+                    'choices': rnd.choices,
+                    'phases': [[phase.name, phase.nr] for phase in rnd.phases],
+                }
+                for rnd in game.rounds
+            ],
+            'strings': sorted(strings, key=strings.get),
+            'byteorder': sys.byteorder,
+            'columns': directory,
+            }
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    start = PREAMBLE.size + len(header)
+    start += -start % ALIGNMENT
+
+    with open(path, 'wb') as output:
+        output.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        output.write(header)
+        output.write(bytes(start - output.tell()))
+        for column in columns.values():
+            data = column.tobytes()
+            output.write(data)
+            output.write(bytes(-len(data) % ALIGNMENT))
+
+
+def read(path):
+    '''Return the header and columns of a snapshot. Columns are views of
+    the memory mapped file, not copies.'''
+    with open(path, 'rb') as snapshot_file:
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, length = PREAMBLE.unpack_from(mapped)
+    if magic != MAGIC:
+        raise SnapshotError('{0} is not a snapshot'.format(path))
+    if version != VERSION:
+        raise SnapshotError('{0} has version {1}, expected {2}'.format(
+                                                    path, version, VERSION))
+    header = json.loads(mapped[PREAMBLE.size:PREAMBLE.size + length])
+    start = PREAMBLE.size + length
+    start += -start % ALIGNMENT
+
+    view = memoryview(mapped)
+    columns = {}
+    for name, (typecode, offset, count) in header['columns'].items():
+        size = array(typecode).itemsize
+        data = view[start + offset:start + offset + count * size]
+        if header['byteorder'] == sys.byteorder:
+            columns[name] = data.cast(typecode)
+        else:
+            column = array(typecode, data.tobytes())
+            column.byteswap()
+            columns[name] = column
+    return header, columns
+
+
+def _phases(columns, prefix, name, strings):
+    offsets = columns[prefix + name + '.offsets']
+    values = columns[prefix + name + '.values']
+    for phase in range(len(offsets) - 1):
+        phase = values[offsets[phase]:offsets[phase + 1]]
+        if name in STRINGS:
+            yield [strings[value] for value in phase]
+        else:
+            yield list(phase)
+
+
+def load(path, card_data=None):
+    '''Rebuild the Game stored in a snapshot, ready for produce_report().'''
+    header, columns = read(path)
+    if card_data is None:
+        card_data = get_card_data(header['expansion_code'])
+    strings = header['strings']
+
+    game = Game()
+    game.information = header['information']
+    for nr, name in enumerate(header['players']):
+        prefix = '{0}.'.format(nr)
+        timeline = zip(
+                columns[prefix + 'explored'],
+                columns[prefix + 'vp'],
+                *(_phases(columns, prefix, column, strings) for column in LISTS)
+                )
+        for phase_nr, (explored, vp, placed, lost, hand, produced) \
+                                                        in enumerate(timeline):
+            if not phase_nr:
+                # The constructor already placed the homeworld and dealt
+                # the starting hand.
+                player = Player(name, placed[0], card_data, game.index)
+                placed, hand = placed[1:], hand[1:]
+            else:
+                player.add_new_phase()
+            player.load_phase(placed, lost, hand, explored, vp, produced)
+        game.players.append(player)
+
+    for stored in header['rounds']:
+        rnd = Round(stored['number'])
+        for player_name, choice in stored['choices']:
+            rnd.add_choice(player_name, choice)
+        for phase_name, phase_nr in stored['phases']:
+            msg = '--- {0} phase ---'.format(phase_name)
+            rnd.phases.append(Phase(msg, phase_nr, rnd.choices, card_data))
+        game.rounds.append(rnd)
+    return game
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 3 and argv[0] == 'save':
+        log, path = argv[1:]
+        input_data = get_data(log)
+        expansion_code = input_data['expansion_code']
+        card_data = get_card_data(expansion_code)
+        game = Replay(card_data).feed_all(input_data['messages'])
+        write(game, path, expansion_code)
+    elif len(argv) in (2, 3) and argv[0] == 'report':
+        produce_report(load(argv[1]), *argv[2:])
+    else:
+        print(__doc__.split('\n\n')[2], file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''Statistics across many replayed games. Requires numpy.
+
+Usage: stats.py LOG_DIR_OR_GLOB...
+'''
+
+import sys
+
+import numpy as np
+
+from core import PHASES
+
+
+GOODS = ('novelty', 'rare', 'gene', 'alien')
+
+
+def to_arrays(games):
+    '''Export per-phase player counters of games into columnar arrays.
+
+    Player counters have the shape (game, round, phase, player), where phase
+    is the position of the phase within its round. Padding cells are zero
+    and phase_type is -1 for them. Returns a dict of arrays:
+
+    phase_type  (game, round, phase)          index into core.PHASES
+    players     (game, player)                True for seats taken
+    chosen      (game, round, phase, player)  player chose the phase
+    explored, cards, hand, vp, placed
+                (game, round, phase, player)  cards counts cards gained, as
+                                              in Player.get_changes()
+    produced    (game, round, phase, player, good)  see GOODS
+    '''
+    games = list(games)
+    shape = (
+            len(games),
+            max((len(game.rounds) for game in games), default=0),
+            max((len(rnd.phases) for game in games for rnd in game.rounds),
+                                                                    default=0),
+            max((len(game.players) for game in games), default=0),
+            )
+
+    arrays = {
+            'phase_type': np.full(shape[:3], -1, dtype=np.int8),
+            'players': np.zeros((shape[0], shape[3]), dtype=bool),
+            'chosen': np.zeros(shape, dtype=bool),
+            'explored': np.zeros(shape, dtype=np.int16),
+            'cards': np.zeros(shape, dtype=np.int16),
+            'hand': np.zeros(shape, dtype=np.int16),
+            'vp': np.zeros(shape, dtype=np.int16),
+            'placed': np.zeros(shape, dtype=np.int16),
+            'produced': np.zeros(shape + (len(GOODS),), dtype=np.int16),
+            }
+
+    for g, game in enumerate(games):
+        arrays['players'][g, :len(game.players)] = True
+        for r, rnd in enumerate(game.rounds):
+            for p, phase in enumerate(rnd.phases):
+                arrays['phase_type'][g, r, p] = PHASES.index(phase.name)
+                choosers = rnd.phase_played_by(phase)
+                for pl, player in enumerate(game.players):
+                    cell = g, r, p, pl
+                    nr = phase.nr
+                    arrays['chosen'][cell] = player.name in choosers
+                    arrays['explored'][cell] = int(player.explored[nr])
+                    arrays['cards'][cell] = sum(c for c in player.hand[nr]
+                                                                if c > 0)
+                    arrays['hand'][cell] = player.get_hand(nr)
+                    arrays['vp'][cell] = player.vp[nr]
+                    arrays['placed'][cell] = len(player.placed[nr])
+                    for good in player.produced[nr]:
+                        arrays['produced'][cell + (GOODS.index(good),)] += 1
+    return arrays
+
+
+def _cells(arrays):
+    '''Phase type of every player cell and the mask of real cells.'''
+    types = np.broadcast_to(arrays['phase_type'][..., np.newaxis],
+                                                    arrays['vp'].shape)
+    valid = (types >= 0) & arrays['players'][:, np.newaxis, np.newaxis, :]
+    return types, valid
+
+
+def _mean_by_phase_type(values, types, valid):
+    totals = np.bincount(types[valid], weights=values[valid],
+                                                    minlength=len(PHASES))
+    counts = np.bincount(types[valid], minlength=len(PHASES))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def vp_per_phase_type(arrays):
+    '''Average VP tokens gained by a player in each type of phase.'''
+    types, valid = _cells(arrays)
+    return _mean_by_phase_type(arrays['vp'], types, valid)
+
+
+def benefit_from_others(arrays):
+    '''For each type of phase, the share of phases chosen by someone else
+    in which a player still gained something.'''
+    types, valid = _cells(arrays)
+    gained = ((arrays['explored'] > 0) | (arrays['cards'] > 0)
+            | (arrays['vp'] > 0) | (arrays['placed'] > 0)
+            | arrays['produced'].any(axis=-1))
+    others = valid & ~arrays['chosen']
+    return _mean_by_phase_type(gained, types, others)
+
+
+def hand_trajectories(arrays):
+    '''Hand size of each player at the end of each round, with the shape
+    (game, round, player). Padding is NaN.'''
+    last = (arrays['phase_type'] >= 0).sum(axis=2) - 1
+    index = np.maximum(last, 0)[:, :, np.newaxis, np.newaxis]
+    index = np.broadcast_to(index, last.shape + (1, arrays['hand'].shape[3]))
+    hand = np.take_along_axis(arrays['hand'], index, axis=2)[:, :, 0, :]
+    hand = hand.astype(float)
+    valid = (last >= 0)[:, :, np.newaxis] & arrays['players'][:, np.newaxis, :]
+    hand[~valid] = np.nan
+    return hand
+
+
+def produced_goods(arrays):
+    '''Total goods produced, with the shape (phase type, good).'''
+    types, valid = _cells(arrays)
+    result = np.zeros((len(PHASES), len(GOODS)), dtype=np.int64)
+    np.add.at(result, types[valid], arrays['produced'][valid])
+    return result
+
+
+def summary(arrays):
+    return {
+            'vp_per_phase_type': dict(zip(PHASES, vp_per_phase_type(arrays))),
+            'benefit_from_others': dict(zip(PHASES,
+                                            benefit_from_others(arrays))),
+            'mean_hand_per_round': np.nanmean(hand_trajectories(arrays),
+                                                    axis=(0, 2)).tolist(),
+            'produced_goods': dict(zip(GOODS,
+                                    produced_goods(arrays).sum(axis=0))),
+            }
+
+
+def main(argv=None):
+    from batch import find_logs, load_game
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    logs = find_logs(argv)
+    if not logs:
+        print('stats.py: error: no logs found', file=sys.stderr)
+        return 2
+    games = [load_game(log) for log in logs]
+    for name, values in summary(to_arrays(games)).items():
+        print(name)
+        if isinstance(values, dict):
+            for key, value in values.items():
+                print('    {0:10} {1:8.3f}'.format(key, value))
+        else:
+            print('    ' + ' '.join('{0:.1f}'.format(v) for v in values))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,60 +1,98 @@
 #!/usr/bin/env python3
 
-import re
-from collections import OrderedDict, Counter
-
-from core import get_phase_name, Player, Phase, Round, Game
-from load_data import get_data, get_card_data
-from render import produce_report
-
-
-input_data = get_data()
-messages = input_data['messages']
-CARD_DATA = get_card_data(input_data['expansion_code'])
-
-
-game = Game()
-
-
-msg = messages[0][0]
-while 'Round' not in msg:
-    if ' starts with ' in msg:
-        name, homeworld = re.search(r'(.+) starts with (.*)\.', msg).groups()
-        game.players.append(Player(name, homeworld, CARD_DATA))
-        # Unfortunately, cards discarded at start of the game are not logged
-        # except for the human player.
-        if homeworld == 'Ancient Race':
-            game.players[-1].hand[-1].append(-1)
-    msg = messages.pop(0)[0]
-
-
-round_nr = 1
-phase_nr = 1
-while 'End of game' not in msg:
-    rnd = Round(round_nr)
-    while 'phase ---' not in msg:
-        # Between Round and Phase
-        rnd.update_choices(msg)
-        msg, fmt = messages.pop(0)
-    while '===' not in msg:
-        if 'phase ---' in msg:
-            phase = Phase(msg, phase_nr, rnd.choices, CARD_DATA)
-            rnd.phases.append(phase)
-            phase_nr += 1
-            game.prepare_players()
-        else:
-            game.update_player(msg, fmt, phase.name)
-        msg, fmt = messages.pop(0)
-    game.rounds.append(rnd)
-    round_nr += 1
-
-
-while 'Game information' not in msg:
-    msg = messages.pop(0)[0]
-
-for x in range(3):
-    game.information.append(messages.pop(0)[0])
-
-
-produce_report(game)
-
+import argparse
+import cProfile
+
+import profiling
+from core import Replay
+from load_data import get_data, follow_data, get_card_data, get_newest_log
+from render import produce_report, Renderer
+
+
+def follow(log, interval, path='report.html', pretty=True, compact=False,
+                                                                sprite=None):
+    '''Keep replaying a log while the game is played, appending every
+    finished round to the report. Game information goes at the end, as it's
+    only known when the game is over.'''
+    input_data = follow_data(log, interval)
+    replay = Replay(get_card_data(input_data['expansion_code']))
+    game = replay.game
+
+    print("Generating '{0}' ...".format(path))
+    with open(path, 'w') as output:
+        renderer = Renderer(output, pretty, compact=compact, sprite=sprite)
+        renderer.begin()
+        try:
+            for msg, fmt in input_data['messages']:
+                replay.feed(msg, fmt)
+                while renderer.rounds_rendered < len(game.rounds):
+                    rnd = game.rounds[renderer.rounds_rendered]
+                    renderer.render_round(rnd, game.players)
+                    output.flush()
+                if replay.state == 'done':
+                    break
+        except KeyboardInterrupt:
+            pass
+        renderer.render_information(game.information)
+        renderer.flush()
+        renderer.end()
+    return game
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Render a Keldon AI log into report.html.')
+    parser.add_argument('log', nargs='?',
+            help='export to read (default: the newest export_ file)')
+    parser.add_argument('-f', '--follow', action='store_true',
+            help='keep watching the log and extend the report as the game '
+                 'goes on')
+    parser.add_argument('--interval', type=float, default=1.0,
+            help='seconds between checks for new messages when following '
+                 '(default: %(default)s)')
+    parser.add_argument('--compact', action='store_true',
+            help='draw repeated icons once with a count and skip indentation')
+    parser.add_argument('--sprite', action='store_true',
+            help='refer to icons in defs.svg next to the report instead of '
+                 'including them; only works when served over HTTP')
+    parser.add_argument('--gzip', action='store_true',
+            help='write report.html.gz instead of report.html')
+    parser.add_argument('--profile', metavar='JSON',
+            help='write time spent in each stage and message counts here')
+    parser.add_argument('--cprofile', metavar='PSTATS',
+            help='run under cProfile and write the stats here')
+    args = parser.parse_args(argv)
+    if args.follow and args.gzip:
+        parser.error("--gzip can't be used with --follow")
+    options = {
+            'pretty': not args.compact,
+            'compact': args.compact,
+            'sprite': 'defs.svg' if args.sprite else None,
+            }
+
+    if args.profile:
+        profiling.enable()
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+
+    if args.follow:
+        game = follow(args.log or get_newest_log(), args.interval,
+                                                                **options)
+    else:
+        input_data = get_data(args.log)
+        card_data = get_card_data(input_data['expansion_code'])
+        game = Replay(card_data).feed_all(input_data['messages'])
+        path = 'report.html.gz' if args.gzip else 'report.html'
+        produce_report(game, path, **options)
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.profile:
+        profiling.count_messages(game)
+        profiling.dump(args.profile)
+
+
+if __name__ == '__main__':
+    main()